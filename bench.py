@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+import funcs
+from funcs import pick_winners, melt_raw_data, week_dates
+from storage import Request, SheetsStorage, parse_range
+
+
+def synthetic_combined(weeks, names, seed=0):
+    rng = np.random.default_rng(seed)
+    combined = pd.DataFrame({"Week Date": pd.date_range("2000-01-03", periods=weeks, freq="7D")})
+    for name in names:
+        workouts = rng.integers(0, 8, weeks)
+        minutes = workouts * rng.integers(10, 60, weeks)
+        combined[f"Minutes ({name})"] = minutes
+        combined[f"Workouts ({name})"] = workouts
+        combined[f"Points ({name})"] = minutes * workouts
+    return combined
+
+
+def winners_apply(combined):
+    # The per-row lambda combine_indiviual_dfs used before pick_winners
+    return combined.apply(lambda row: "None :(" if (row["Minutes (Lauren)"] < 90 and row["Minutes (Tara)"] < 90) or (row["Workouts (Lauren)"] < 3 and row["Workouts (Tara)"] < 3) else ("Lauren" if (row["Minutes (Lauren)"] * row["Workouts (Lauren)"]) > (row["Minutes (Tara)"] * row["Workouts (Tara)"]) else ("Tara" if (row["Minutes (Lauren)"] * row["Workouts (Lauren)"]) < (row["Minutes (Tara)"] * row["Workouts (Tara)"]) else "Tie")), axis=1)
+
+
+def bench_winners(weeks, repeat):
+    combined = synthetic_combined(weeks, ["Lauren", "Tara"])
+    assert (winners_apply(combined).to_numpy() == pick_winners(combined, ["Lauren", "Tara"])).all()
+    before = min(timeit.repeat(lambda: winners_apply(combined), number=1, repeat=repeat))
+    after = min(timeit.repeat(lambda: pick_winners(combined, ["Lauren", "Tara"]), number=1, repeat=repeat))
+    print(f"winners ({weeks} weeks): apply {before * 1000:.1f}ms, vectorized {after * 1000:.1f}ms, {before / after:.0f}x")
+
+
+def synthetic_tracker(years, people, seed=0):
+    # Wide tracker layout: Day plus a minutes and an activity column per person
+    rng = np.random.default_rng(seed)
+    days = pd.date_range("2000-01-01", periods=365 * years, freq="D")
+    columns = {"Day": days.strftime("%m/%d/%Y")}
+    for i in range(people):
+        columns[f"P{i}"] = rng.integers(0, 90, len(days)).astype(str)
+        columns[f"P{i}_activity"] = rng.choice(["walk", "bike", "yoga"], len(days))
+    return pd.DataFrame(columns), {f"P{i}": f"P{i}_activity" for i in range(people)}
+
+
+def melt_apply(raw, people):
+    # The per-row isocalendar/timedelta version get_and_melt_raw_data used before
+    raw["Day"] = pd.to_datetime(raw["Day"])
+    raw = raw.sort_values("Day").drop_duplicates()
+    melted = pd.concat([raw[["Day", name, activity]].rename(columns={activity: "Activity"}).melt(id_vars=["Day", "Activity"], value_vars=[name], var_name="Name", value_name="Minutes") for name, activity in people.items()])
+    melted["Day"] = pd.to_datetime(melted["Day"])
+    melted["Week"] = melted["Day"].apply(lambda x: x.isocalendar()[1])
+    melted["Week Date"] = melted["Day"].apply(lambda x: x - timedelta(days=x.weekday() % 7))
+    melted["Day"] = melted["Day"].astype(str)
+    melted["Week Date"] = melted["Week Date"].astype(str)
+    return melted[["Day", "Week", "Week Date", "Name", "Activity", "Minutes"]]
+
+
+def week_dates_loop(start_date, end_date):
+    weeks = []
+    tally_week = start_date
+    while tally_week <= pd.to_datetime(end_date):
+        weeks.append(tally_week)
+        tally_week = tally_week + timedelta(days=7)
+    weeks = pd.DataFrame(weeks, columns=["Week Date"])
+    weeks["Week"] = weeks["Week Date"].apply(lambda x: x.isocalendar().week)
+    return weeks[["Week", "Week Date"]]
+
+
+def bench_melt(years, people, repeat):
+    raw, mapping = synthetic_tracker(years, people)
+    rows = len(raw) * people
+    before = min(timeit.repeat(lambda: melt_apply(raw.copy(), mapping), number=1, repeat=repeat))
+    after = min(timeit.repeat(lambda: melt_raw_data(raw.copy(), mapping), number=1, repeat=repeat))
+    print(f"melt ({years} years x {people} people, {rows} rows): apply {before * 1000:.1f}ms ({rows / before:,.0f} rows/s), vectorized {after * 1000:.1f}ms ({rows / after:,.0f} rows/s), {before / after:.0f}x")
+
+    start, end = pd.Timestamp("2000-01-03"), pd.Timestamp("2000-01-03") + timedelta(weeks=52 * years)
+    before = min(timeit.repeat(lambda: week_dates_loop(start, end), number=1, repeat=repeat))
+    after = min(timeit.repeat(lambda: week_dates(start, end), number=1, repeat=repeat))
+    print(f"week_dates ({52 * years} weeks): loop {before * 1000:.1f}ms, vectorized {after * 1000:.1f}ms, {before / after:.0f}x")
+
+
+def bench_startup(repeat):
+    # Fresh interpreters: importing funcs alone vs importing it and building
+    # the storage client, which is what every import used to do. Run from
+    # the repo so funcs imports wherever bench.py is started from.
+    def run(code):
+        times = []
+        for _ in range(repeat):
+            result = subprocess.run([sys.executable, "-c", f"import time; start = time.perf_counter(); {code}; print(time.perf_counter() - start)"],
+                                    capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if result.returncode != 0:
+                return None
+            times.append(float(result.stdout.split()[-1]))
+        return min(times)
+
+    lazy = run("import funcs")
+    if lazy is None:
+        print("startup: import funcs failed, check the requirements are installed")
+        return
+    eager = run("import funcs; funcs.get_storage()")
+    if eager is None:
+        print(f"startup: import funcs {lazy * 1000:.0f}ms (building the client failed, check secrets)")
+    else:
+        print(f"startup: import funcs {lazy * 1000:.0f}ms, import + build client {eager * 1000:.0f}ms")
+
+
+class FakeSheetsService:
+    # In-memory stand-in for the googleapiclient service, enough of it for
+    # SheetsStorage reads. Counts requests and the JSON size of the responses.
+    def __init__(self, tabs):
+        self.tabs = tabs
+        self.calls = 0
+        self.bytes = 0
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def read(self, range_name):
+        tab, first_col, last_col, first_row, last_row = parse_range(range_name)
+        rows = [row[first_col:last_col] for row in self.tabs.get(tab, [])[first_row - 1:last_row]]
+        return {"range": range_name, "values": rows} if rows else {"range": range_name}
+
+    def request(self, fn):
+        def execute():
+            response = fn()
+            self.calls += 1
+            self.bytes += len(json.dumps(response))
+            return response
+        return Request(execute)
+
+    def get(self, spreadsheetId, range):
+        return self.request(lambda: self.read(range))
+
+    def batchGet(self, spreadsheetId, ranges):
+        return self.request(lambda: {"spreadsheetId": spreadsheetId, "valueRanges": [self.read(range_name) for range_name in ranges]})
+
+
+def synthetic_sheets(people, years, workouts, seed=0):
+    # The data, new_data and tracker tabs for `people` people logging about
+    # `workouts` workouts a week for `years` years, as the strings Sheets returns
+    rng = np.random.default_rng(seed)
+    names = ["Lauren", "Tara"] + [f"P{i}" for i in range(2, people)]
+    days = pd.date_range("2000-01-03", periods=365 * years, freq="D")
+    logged = rng.random((len(days), people)) < workouts / 7
+    day_idx, person_idx = np.nonzero(logged)
+    day = days[day_idx]
+    minutes = rng.integers(10, 90, len(day_idx))
+    activities = rng.choice(["walk", "Bike", " yoga", "climb "], len(day_idx))
+    rows = pd.DataFrame({
+        "Day": day.strftime("%Y-%m-%d"),
+        "Week": day.isocalendar().week.astype(str).to_numpy(),
+        "Week Date": (day - pd.to_timedelta(day.weekday, unit="D")).strftime("%Y-%m-%d"),
+        "Name": np.array(names)[person_idx],
+        "Activity": activities,
+        "Minutes": minutes.astype(str),
+        "Distance": np.round(rng.random(len(day_idx)) * 5, 1).astype(str),
+    })
+    # The last four weeks sit in new_data like rows logged from the app
+    recent = day >= days[-28]
+    data = [rows.columns.tolist()] + rows[~recent].to_numpy().tolist()
+    new_data = [rows.columns.tolist() + ["Notes"]] + [row + [""] for row in rows[recent].to_numpy().tolist()]
+
+    tracker = {"Day": days.strftime("%m/%d/%Y")}
+    for i, name in enumerate(names):
+        tracker[name] = np.where(logged[:, i], rng.integers(10, 90, len(days)), 0).astype(str)
+        tracker[f"{name}_activity"] = np.where(logged[:, i], rng.choice(["walk", "bike", "yoga"], len(days)), "")
+    tracker = pd.DataFrame(tracker)
+    tabs = {"data": data, "new_data": new_data, "tracker": [tracker.columns.tolist()] + tracker.to_numpy().tolist()}
+    return tabs, names, {name: f"{name}_activity" for name in names}
+
+
+def measure(fn, setup, service, repeat):
+    # Best wall time of `repeat` runs, then one more run under tracemalloc for
+    # peak memory and the API calls/bytes that run made
+    times = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    setup()
+    calls, sent = service.calls, service.bytes
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": min(times), "peak_bytes": peak, "calls": service.calls - calls, "bytes": service.bytes - sent}
+
+
+def bench_pipeline(people, years, workouts, repeat):
+    tabs, names, mapping = synthetic_sheets(people, years, workouts)
+    service = FakeSheetsService(tabs)
+    funcs.set_storage(SheetsStorage(service))
+    spreadsheet_id, range_name = "bench", "data!A:G"
+    snapshot_dir = tempfile.mkdtemp()
+
+    def cold():
+        funcs.invalidate_cache(spreadsheet_id)
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    def warm():
+        # Snapshot on disk, read cache expired: one batchGet for the tails
+        funcs.invalidate_cache(spreadsheet_id)
+
+    def nothing():
+        pass
+
+    df = funcs.historic_and_new_data(range_name, spreadsheet_id)
+    weekly = funcs.weekly_by_person(df)
+    weeks = week_dates(df["Week Date"].min(), df["Week Date"].max())
+    combined = funcs.leaderboard(weekly, weeks, names)
+    named = {name: funcs.prep_by_name(df, name) for name in names}
+    recent = weeks["Week Date"].iloc[-12:].tolist()
+
+    stages = {
+        "historic_and_new_data": (lambda: funcs.historic_and_new_data(range_name, spreadsheet_id), cold),
+        "synced_data (cold)": (lambda: funcs.synced_data(range_name, spreadsheet_id, snapshot_dir), cold),
+        "synced_data (warm)": (lambda: funcs.synced_data(range_name, spreadsheet_id, snapshot_dir), warm),
+        "weekly_by_person": (lambda: funcs.weekly_by_person(df), nothing),
+        "prep_by_name": (lambda: [funcs.prep_by_name(df, name) for name in names], nothing),
+        "combine_indiviual_dfs": (lambda: funcs.combine_indiviual_dfs(named["Lauren"], named["Tara"], weeks), nothing),
+        "leaderboard": (lambda: funcs.leaderboard(weekly, weeks, names), nothing),
+        "week_dates": (lambda: week_dates(df["Week Date"].min(), df["Week Date"].max()), nothing),
+        "pick_winners": (lambda: pick_winners(combined, names), nothing),
+        "weekly_minutes_workouts_points": (lambda: [funcs.weekly_minutes_workouts_points(named[name], week) for name in names for week in recent], nothing),
+        "week_index + week_metrics": (lambda: [funcs.week_metrics(index, name, week) for index in [funcs.week_index(weekly)] for name in names for week in recent], nothing),
+        "get_and_melt_raw_data": (lambda: funcs.get_and_melt_raw_data(spreadsheet_id, "tracker!A:ZZ", mapping), cold),
+    }
+    results = {}
+    print(f"pipeline ({people} people x {years} years x {workouts} workouts/week, {len(df)} rows):")
+    for stage, (fn, setup) in stages.items():
+        # Prime the snapshot once so the warm runs have one to sync against
+        if stage == "synced_data (warm)":
+            cold()
+            fn()
+        results[stage] = measure(fn, setup, service, repeat)
+        result = results[stage]
+        print(f"  {stage:32} {result['seconds'] * 1000:9.1f}ms {result['peak_bytes'] / 2 ** 20:8.1f}MiB peak {result['calls']:3d} calls {result['bytes'] / 2 ** 20:7.1f}MiB fetched")
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    return {"params": {"people": people, "years": years, "workouts": workouts}, "stages": results}
+
+
+def compare(results, baseline, tolerance):
+    # Slower or bigger than the baseline by more than `tolerance`, or any extra
+    # API call, counts as a regression
+    if results["params"] != baseline["params"]:
+        print(f"warning: baseline was taken with {baseline['params']}, this run used {results['params']}")
+    regressions = []
+    for stage, result in results["stages"].items():
+        base = baseline["stages"].get(stage)
+        if base is None:
+            continue
+        for metric in ["seconds", "peak_bytes"]:
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{stage}: {metric} {base[metric]:.4g} -> {result[metric]:.4g} ({result[metric] / base[metric] - 1:+.0%})")
+        if result["calls"] > base["calls"]:
+            regressions.append(f"{stage}: calls {base['calls']} -> {result['calls']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the data pipeline on synthetic data")
+    parser.add_argument("--weeks", type=int, default=52 * 50)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--people", type=int, default=50)
+    parser.add_argument("--workouts", type=int, default=4, help="workouts per person per week in the pipeline data")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pipeline-only", action="store_true", help="skip the before/after comparisons and startup timing")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the pipeline results here")
+    parser.add_argument("--compare", metavar="PATH", help="exit 1 if the pipeline regressed against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown/memory growth for --compare")
+    args = parser.parse_args()
+    if not args.pipeline_only:
+        bench_winners(args.weeks, args.repeat)
+        bench_melt(args.years, args.people, args.repeat)
+        bench_startup(args.repeat)
+    results = bench_pipeline(args.people, args.years, args.workouts, args.repeat)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import pandas as pd
+from funcs import TRACKER_PEOPLE, append_to_sheet, get_data, melt_raw_data, row_key, sheet_values, tail_range
+
+# Backfill history without running the app: stream the wide Day/<Name>/<activity>
+# layout (exerise_competition_data.csv or the tracker tab) in chunks, melt each
+# chunk like get_and_melt_raw_data and write it out in bounded batches.
+# Progress is saved after every batch so an interrupted import picks up where it
+# stopped, with the same chunk and batch sizes (batch numbers only mean
+# something for those). The first batch after a resume may have gone out
+# before the crash, so it's checked against the target first.
+
+
+def csv_chunks(path, chunk_size, skip_rows):
+    reader = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size, skiprows=range(1, skip_rows + 1))
+    for chunk in reader:
+        yield chunk
+
+
+def tracker_chunks(spreadsheet_id, range_name, chunk_size, skip_rows):
+    header = get_data(spreadsheet_id, tail_range(range_name, 1, 1), cache=False)[0]
+    start = skip_rows + 2
+    while True:
+        rows = get_data(spreadsheet_id, tail_range(range_name, start, start + chunk_size - 1), cache=False)
+        if len(rows) == 0:
+            return
+        yield pd.DataFrame(rows, columns=header)
+        start += chunk_size
+
+
+def load_state(path, source, chunk_size, batch_size):
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        if state["source"] == source:
+            if (state.get("chunk_size"), state.get("batch_size")) != (chunk_size, batch_size):
+                raise ValueError(f"{path} was saved with --chunk-size {state.get('chunk_size')} --batch-size {state.get('batch_size')}, "
+                                 f"resume with the same sizes or delete it to start over")
+            return state
+    return {"source": source, "chunk_size": chunk_size, "batch_size": batch_size, "rows_done": 0, "batches_done": 0}
+
+
+def save_state(path, state):
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def sheet_writer(spreadsheet_id, range_name):
+    # Empty target tab: the first batch writes the header row too
+    needs_header = [len(get_data(spreadsheet_id, tail_range(range_name, 1, 1), cache=False)) == 0]
+
+    def write(batch, part, recheck=False):
+        rows = sheet_values(batch)
+        if recheck:
+            sent = {row_key(row) for row in get_data(spreadsheet_id, range_name, cache=False)}
+            rows = [row for row in rows if row_key(row) not in sent]
+        if needs_header[0]:
+            rows.insert(0, batch.columns.tolist())
+        if len(rows) > 0:
+            append_to_sheet(rows, spreadsheet_id, range_name).execute()
+        needs_header[0] = False
+    return write
+
+
+def parquet_writer(out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+
+    def write(batch, part, recheck=False):
+        # Parts are named by position, so writing one again just replaces it
+        batch.to_parquet(os.path.join(out_dir, f"part-{part}.parquet"), index=False)
+    return write
+
+
+def bulk_import(chunks, write, state, state_path, batch_size, people=TRACKER_PEOPLE):
+    recheck = state["rows_done"] > 0 or state["batches_done"] > 0
+    for chunk in chunks:
+        melted = melt_raw_data(chunk, people).reset_index(drop=True)
+        batches = range(0, len(melted), batch_size)
+        for batch_no, start in enumerate(batches):
+            if batch_no < state["batches_done"]:
+                continue
+            write(melted.iloc[start:start + batch_size], f"{state['rows_done']:09d}-{batch_no:05d}", recheck)
+            recheck = False
+            state["batches_done"] = batch_no + 1
+            save_state(state_path, state)
+        state["rows_done"] += len(chunk)
+        state["batches_done"] = 0
+        save_state(state_path, state)
+        print(f"imported {state['rows_done']} source rows")
+    return state
+
+
+def parse_people(value):
+    people = {}
+    for pair in value.split(","):
+        name, _, activity = pair.partition(":")
+        people[name] = activity
+    return people
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import wide tracker data into the data sheet or a local Parquet store")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", help="path to a CSV in the Day,<Name>,<activity> layout")
+    source.add_argument("--tracker", help="sheet range in the same layout, e.g. tracker!A:E")
+    parser.add_argument("--spreadsheet-id", default="1BAWUiSI8jV0hSmaD9b_68CaRgSca9J_Odb1TpWRYuZU")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--range", default="data!A:G", help="sheet range to append melted rows to")
+    target.add_argument("--out-dir", help="write Parquet parts here instead of the sheet")
+    parser.add_argument("--people", type=parse_people, default=TRACKER_PEOPLE, help="Name:activity_column pairs, comma separated")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="source rows read at a time")
+    parser.add_argument("--batch-size", type=int, default=1000, help="melted rows per write")
+    parser.add_argument("--state", default=".import_state.json", help="progress file used to resume")
+    args = parser.parse_args()
+
+    source_name = args.csv or f"{args.spreadsheet_id}/{args.tracker}"
+    try:
+        state = load_state(args.state, source_name, args.chunk_size, args.batch_size)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.csv:
+        chunks = csv_chunks(args.csv, args.chunk_size, state["rows_done"])
+    else:
+        chunks = tracker_chunks(args.spreadsheet_id, args.tracker, args.chunk_size, state["rows_done"])
+    if args.out_dir:
+        write = parquet_writer(args.out_dir)
+    else:
+        write = sheet_writer(args.spreadsheet_id, args.range)
+    bulk_import(chunks, write, state, args.state, args.batch_size, args.people)
@@ -0,0 +1,99 @@
+import streamlit as st
+
+# Dashboard figures and tables. Each builder takes a content hash of the frame
+# it draws (see funcs.frame_hash) as its cache key; the frame itself is passed
+# as an underscore argument so Streamlit doesn't hash it again. Reruns where
+# the data hasn't changed (typing in the sidebar form, say) reuse the cached
+# figure instead of rebuilding it.
+
+person_colors = {"Lauren": "#d90429", "Tara": "#2b2d42"}
+activity_colors = {
+    "walk": "#8D99AE",
+    "climb": "#D80032",
+    "yoga": "#2B2D42",
+    "bike": "#9BAA4E",
+    "other": "#CECEA6",
+    "elliptical": "#F4F2DC",
+    "weights": "#DFC685",
+    "stretching": "#214A51",
+    "hike": "#545A66",
+    "cleaning": "#B48354"
+}
+
+
+@st.cache_resource(max_entries=8)
+def winners_pie(data_hash, _combined):
+    import plotly.express as px
+    fig = px.pie(_combined["Winner"].value_counts().reset_index(),
+                 values="count",
+                 names="Winner",
+                 color="Winner",
+                 color_discrete_map={"None :(": "#EDF2F4",
+                                     "Tie": "#8D99AE",
+                                     "Lauren": "#D80032",
+                                     "Tara": "#2B2D42"})
+    fig.update_layout(height=300,
+                      width=400,
+                      margin=dict(l=0, r=80, t=0, b=80, pad=0)
+                      )
+    return fig
+
+
+@st.cache_resource(max_entries=256)
+def activity_pie(data_hash, name, _df):
+    import plotly.express as px
+    fig = px.pie(_df[(_df["Name"] == name) & (_df["Activity"] != "")].Activity.value_counts().loc[lambda counts: counts > 0].reset_index(),
+                 values="count",
+                 names="Activity",
+                 color="Activity",
+                 color_discrete_map=activity_colors)
+    fig.update_layout(height=300,
+                      width=400,
+                      margin=dict(l=0, r=80, t=0, b=80, pad=0)
+                      )
+    return fig
+
+
+@st.cache_resource(max_entries=16)
+def weekly_bars(data_hash, metric, names, _combined):
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    for name in names:
+        fig.add_trace(go.Bar(x=_combined["Week Date"], y=_combined[f"{metric} ({name})"], name=name, marker_color=person_colors.get(name)))
+    fig.update_layout(plot_bgcolor="#FCFDFD", xaxis_title="Week", yaxis_title="Count", margin=dict(l=0, r=0, t=0, b=0, pad=0), height=400, legend_yanchor="middle", legend_y=0.5)
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor="#D7DBE2")
+    return fig
+
+
+@st.cache_resource(max_entries=16)
+def weekly_lines(data_hash, metric, names, y_title, since, _combined):
+    import plotly.graph_objects as go
+    if since is not None:
+        _combined = _combined[_combined["Week Date"] >= since]
+    fig = go.Figure()
+    for name in names:
+        fig.add_trace(go.Scatter(x=_combined["Week Date"], y=_combined[f"{metric} ({name})"], mode="lines+markers", name=name, line=dict(color=person_colors.get(name))))
+    fig.update_layout(plot_bgcolor="#FCFDFD", xaxis_title="Week", yaxis_title=y_title, margin=dict(l=0, r=0, t=0, b=0, pad=0), height=400, legend_yanchor="middle", legend_y=0.5)
+    fig.update_xaxes(showline=True, linewidth=2, linecolor='#8D99AE')
+    fig.update_yaxes(showline=True, linewidth=2, linecolor='#8D99AE', showgrid=True, gridwidth=1, gridcolor="#D7DBE2")
+    return fig
+
+
+@st.cache_data(max_entries=8)
+def display_table(data_hash, sort_by, _df):
+    # Newest first, dates already formatted, instead of a Styler with a
+    # per-cell lambda over every row
+    table = _df.sort_values(by=sort_by, ascending=False)
+    for col in ["Week Date", "Day"]:
+        if col in table:
+            table[col] = table[col].dt.strftime("%y-%m-%d")
+    return table
+
+
+def paginated_table(table, key, page_size=50):
+    # Only the selected page is sent to the browser
+    pages = max(1, -(-len(table) // page_size))
+    col1, col2 = st.columns([1, 5])
+    page = col1.number_input("Page", min_value=1, max_value=pages, value=1, key=f"{key}_page")
+    col2.caption(f"Page {page} of {pages} ({len(table)} rows)")
+    st.dataframe(table.iloc[(page - 1) * page_size:page * page_size], width=1500)
@@ -1,28 +1,181 @@
-from google.oauth2 import service_account
-from googleapiclient import discovery
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-import streamlit as st
+import bisect
+import hashlib
+import json
+import os
+import string
+import threading
+import time
+import numpy as np
 import pandas as pd
-
-# SA Creds
-creds = service_account.Credentials.from_service_account_info(
-    st.secrets["gcp_service_account"],
-    scopes=[
-        "https://www.googleapis.com/auth/spreadsheets",
-    ],
-)
-service = discovery.build('sheets', 'v4', credentials=creds)
+from pandas.api.types import union_categoricals
+from outbox import Outbox
+from profiling import count_request, timed
+from storage import Request, SheetsStorage, SqliteStorage
+
+# streamlit and the Google client are imported where they're used, so scripts
+# that only need the data helpers don't pay for them (or need secrets) on import
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    # Built on first use and shared by every session in this process
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = make_storage()
+        return _storage
+
+
+def set_storage(backend):
+    global _storage
+    with _storage_lock:
+        _storage = backend
+
+
+def make_storage():
+    # WWO_STORAGE=sqlite:<dir> (or [storage] backend = "sqlite" in secrets)
+    # swaps Google Sheets for a local SQLite copy, no Google account needed
+    import streamlit as st
+    backend = os.environ.get("WWO_STORAGE", "")
+    if backend.startswith("sqlite:"):
+        return SqliteStorage(backend[len("sqlite:"):] or "storage")
+    if backend == "" and "storage" in st.secrets and st.secrets["storage"].get("backend") == "sqlite":
+        return SqliteStorage(st.secrets["storage"].get("path", "storage"))
+
+    from google.oauth2 import service_account
+    from googleapiclient import discovery
+
+    # SA Creds
+    creds = service_account.Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"],
+        scopes=[
+            "https://www.googleapis.com/auth/spreadsheets",
+        ],
+    )
+    # WWO_DISCOVERY_DOC points at a saved sheets v4 discovery document,
+    # otherwise the one bundled with googleapiclient is used (no fetch)
+    discovery_doc = os.environ.get("WWO_DISCOVERY_DOC")
+    if discovery_doc:
+        with open(discovery_doc) as f:
+            service = discovery.build_from_document(f.read(), credentials=creds)
+    else:
+        service = discovery.build('sheets', 'v4', credentials=creds, static_discovery=True, cache_discovery=False)
+    return SheetsStorage(service)
+
+
+# Read cache, shared by every session in this process
+CACHE_TTL = 60
+CACHE_MAX_ENTRIES = 32
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+# Bumped by every invalidate, per (spreadsheet, tab) and per spreadsheet, so a
+# read that was already in flight when a write landed doesn't cache old rows
+_generations = {}
+
+
+def _tab_name(range_name):
+    return range_name.split("!")[0]
+
+
+def cache_info():
+    with _cache_lock:
+        return {**_cache_stats, "size": len(_cache)}
+
+
+def _generation(spreadsheet_id, range_name):
+    with _cache_lock:
+        return (_generations.get((spreadsheet_id, None), 0), _generations.get((spreadsheet_id, _tab_name(range_name)), 0))
+
+
+def invalidate_cache(spreadsheet_id, range_name=None):
+    # Any write to a tab makes every cached range of that tab stale
+    with _cache_lock:
+        tab = None if range_name is None else _tab_name(range_name)
+        _generations[(spreadsheet_id, tab)] = _generations.get((spreadsheet_id, tab), 0) + 1
+        for key in list(_cache):
+            if key[0] == spreadsheet_id and (range_name is None or _tab_name(key[1]) == _tab_name(range_name)):
+                del _cache[key]
+
+
+def _cached(key):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] < CACHE_TTL:
+            _cache.move_to_end(key)
+            _cache_stats["hits"] += 1
+            return entry[1]
+        _cache_stats["misses"] += 1
+        return None
+
+
+def _remember(key, rows, fetched_at, generation):
+    # generation is _generation() from before the fetch
+    with _cache_lock:
+        if (_generations.get((key[0], None), 0), _generations.get((key[0], _tab_name(key[1])), 0)) != generation:
+            return
+        _cache[key] = (fetched_at, rows)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+@timed()
+def get_data(spreadsheet_id, range_name, cache=True):
+    key = (spreadsheet_id, range_name)
+    rows = _cached(key) if cache else None
+    if rows is not None:
+        return rows
+
+    fetched_at, generation = time.monotonic(), _generation(spreadsheet_id, range_name)
+    result = get_storage().get(spreadsheet_id, range_name).execute()
+    count_request(result)
+    rows = result.get('values', {})
+    if cache:
+        _remember(key, rows, fetched_at, generation)
+    return rows
 
 
-def get_data(spreadsheet_id, range_name):
-    result = service.spreadsheets().values().get(
-        spreadsheetId=spreadsheet_id, range=range_name).execute()
-    rows = result.get('values', {})
+@timed()
+def get_many(spreadsheet_id, range_names):
+    # Every range a render needs in one round trip: cached ranges are reused,
+    # the rest go out as one batchGet (or in parallel if the backend can't batch)
+    rows = {}
+    missing = []
+    for range_name in dict.fromkeys(range_names):
+        cached = _cached((spreadsheet_id, range_name))
+        if cached is None:
+            missing.append(range_name)
+        else:
+            rows[range_name] = cached
+    if len(missing) == 0:
+        return rows
+
+    fetched_at = time.monotonic()
+    generations = {range_name: _generation(spreadsheet_id, range_name) for range_name in missing}
+    storage = get_storage()
+    if hasattr(storage, "batch_get"):
+        result = storage.batch_get(spreadsheet_id, missing).execute()
+        count_request(result)
+        fetched = [value_range.get('values', {}) for value_range in result.get('valueRanges', [])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+            results = list(pool.map(lambda range_name: storage.get(spreadsheet_id, range_name).execute(), missing))
+        for result in results:
+            count_request(result)
+        fetched = [result.get('values', {}) for result in results]
+    for range_name, range_rows in zip(missing, fetched):
+        rows[range_name] = range_rows
+        _remember((spreadsheet_id, range_name), range_rows, fetched_at, generations[range_name])
     return rows
 
 
 def get_sheets(spreadsheet_id):
-    sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+    sheet_metadata = get_storage().metadata(spreadsheet_id).execute()
     sheets = sheet_metadata.get('sheets', '')
     titles = []
     ids = []
@@ -32,32 +185,192 @@ def get_sheets(spreadsheet_id):
     return sheets, titles, ids
 
 
-def historic_and_new_data(range_name, spreadsheet_id):
-    rows = get_data(spreadsheet_id, range_name)
-    df = pd.DataFrame(rows[1:], columns=rows[0])
+@timed()
+def historic_and_new_data(range_name, spreadsheet_id, new_range="new_data!A:H"):
+    pending = pending_rows(spreadsheet_id, new_range)
+    fetched = get_many(spreadsheet_id, [range_name, new_range])
+    rows = fetched[range_name]
+    df = typed_frame(rows[1:], rows[0])
 
-    row_updates = get_data(spreadsheet_id, "new_data!A:H")
+    row_updates = fetched[new_range]
     if len(row_updates) > 0:
-        new_rows = pd.DataFrame(row_updates[1:], columns=row_updates[0])
-        df = pd.concat([df, new_rows])
-        df = df.drop_duplicates().sort_values(by="Day").reset_index(drop=True)
+        new_rows = typed_frame(row_updates[1:], row_updates[0])
+        df = combine_typed([df, new_rows])
+
+    return with_pending(df, pending)
+
+
+# The data/new_data layout. Older data tabs (written by the tracker migration)
+# stop before Distance, read those as 0.
+ROW_COLUMNS = ["Day", "Week", "Week Date", "Name", "Activity", "Minutes", "Distance", "Notes"]
+
+
+def typed_frame(rows, columns):
+    # Sheets rows straight into typed columns: dates as datetime64, small ints,
+    # float32 distance and categorical Name/Activity (normalised here, once).
+    # Always the full ROW_COLUMNS layout, whatever the tab's header has.
+    width = len(columns)
+    values = dict(zip(columns, zip(*[row + [None] * (width - len(row)) for row in rows]))) if len(rows) > 0 else {}
+    df = pd.DataFrame({col: pd.Series(values.get(col, (None,) * len(rows)), dtype=object) for col in ROW_COLUMNS})
+    # Cleared rows come back as [], they have neither a Day nor a Name
+    blank = df["Day"].fillna("").eq("") & df["Name"].fillna("").eq("")
+    if blank.any():
+        df = df[~blank].reset_index(drop=True)
+    return cast_columns(df)
+
+
+def cast_columns(df):
+    df = df.reindex(columns=ROW_COLUMNS)
+    for col in ["Day", "Week Date"]:
+        df[col] = pd.to_datetime(df[col], format="ISO8601")
+    df["Week"] = pd.to_numeric(df["Week"], errors="coerce").fillna(0).astype("int16")
+    df["Minutes"] = pd.to_numeric(df["Minutes"], errors="coerce").fillna(0).astype("int16")
+    df["Distance"] = pd.to_numeric(df["Distance"], errors="coerce").fillna(0).astype("float32")
+    df["Name"] = df["Name"].astype("category")
+    df["Activity"] = df["Activity"].fillna("").str.lower().str.strip().astype("category")
+    df["Notes"] = df["Notes"].fillna("")
+    return df
 
-    df["Minutes"] = df["Minutes"].astype(int)
-    df["Distance"] = df["Distance"].astype(float)
-    df["Week"] = df["Week"].astype(int)
 
+def combine_typed(frames):
+    # concat falls back to object when categories differ, so re-categorise
+    df = pd.concat(frames, ignore_index=True)
+    for col in ["Name", "Activity"]:
+        df[col] = df[col].astype("category")
+    df = df.drop_duplicates().sort_values(by="Day").reset_index(drop=True)
     return df
 
 
+# Local snapshot of historic_and_new_data, synced from the sheet by row count
+SNAPSHOT_DIR = ".snapshot"
+SNAPSHOT_VERSION = 4
+_snapshot_lock = threading.Lock()
+
+
+def tail_range(range_name, start_row, end_row=None):
+    tab, cells = range_name.split("!")
+    first, last = cells.split(":")
+    end_row = "" if end_row is None else end_row
+    return f"{tab}!{first.rstrip(string.digits)}{start_row}:{last.rstrip(string.digits)}{end_row}"
+
+
+def snapshot_ranges(marks, range_names):
+    # Whole ranges for tabs without a mark, otherwise from the last row the
+    # snapshot has, which is read again to check it's still the same row
+    return {range_: range_ if range_ not in marks else tail_range(range_, marks[range_]["rows"]) for range_ in range_names}
+
+
+def snapshot_current(marks, ranges, fetched):
+    # False when the last row of a tab the snapshot has was edited or deleted
+    # in the sheet (a deleted row shifts everything after it up)
+    for range_, fetch_range in ranges.items():
+        mark = marks.get(range_)
+        rows = fetched[fetch_range]
+        if mark is not None and (len(rows) == 0 or row_key(rows[0]) != row_key(mark["last"])):
+            return False
+    return True
+
+
+@timed()
+def synced_data(range_name, spreadsheet_id, snapshot_dir=SNAPSHOT_DIR, rebuild=False, new_range="new_data!A:H", partition=None):
+    # The tabs are append-only, so anything past the stored row count is new.
+    # Edits to the last synced row and deleted rows are picked up by
+    # re-reading that row, other hand edits need rebuild=True (?rebuild=1 in
+    # the app). Tabs other than data/new_data (a season's own tabs) need their
+    # own partition name so they get a separate snapshot.
+    # Queued submits are added to what's returned but never to the snapshot.
+    name = spreadsheet_id if partition is None else f"{spreadsheet_id}-{partition}"
+    path = os.path.join(snapshot_dir, f"{name}.parquet")
+    marks_path = os.path.join(snapshot_dir, f"{name}.json")
+    pending = pending_rows(spreadsheet_id, new_range)
+    with _snapshot_lock:
+        df, marks = None, {}
+        if not rebuild and os.path.exists(path) and os.path.exists(marks_path):
+            with open(marks_path) as f:
+                marks = json.load(f)
+            if marks.pop("version", None) == SNAPSHOT_VERSION:
+                df = pd.read_parquet(path)
+            else:
+                marks = {}
+
+        ranges = snapshot_ranges(marks, [range_name, new_range])
+        try:
+            fetched = get_many(spreadsheet_id, list(ranges.values()))
+            if not snapshot_current(marks, ranges, fetched):
+                ranges = snapshot_ranges({}, [range_name, new_range])
+                fetched = get_many(spreadsheet_id, list(ranges.values()))
+                df, marks = None, {}
+        except Exception:
+            # Sheets is down or rate limiting us, serve the snapshot read-only
+            if df is None:
+                raise
+            return with_pending(df, pending)
+
+        new_frames = []
+        for range_, fetch_range in ranges.items():
+            rows = fetched[fetch_range]
+            mark = marks.get(range_)
+            if mark is None:
+                if len(rows) == 0:
+                    continue
+                marks[range_] = {"rows": len(rows), "columns": rows[0], "last": rows[-1]}
+                new_frames.append(typed_frame(rows[1:], rows[0]))
+            elif len(rows) > 1:
+                mark["rows"] += len(rows) - 1
+                mark["last"] = rows[-1]
+                new_frames.append(typed_frame(rows[1:], mark["columns"]))
+
+        if len(new_frames) == 0:
+            return with_pending(df, pending)
+
+        if df is not None:
+            new_frames.insert(0, df)
+        df = combine_typed(new_frames)
+
+        os.makedirs(snapshot_dir, exist_ok=True)
+        df.to_parquet(path + ".tmp", index=False)
+        with open(marks_path + ".tmp", "w") as f:
+            json.dump({**marks, "version": SNAPSHOT_VERSION}, f)
+        os.replace(path + ".tmp", path)
+        os.replace(marks_path + ".tmp", marks_path)
+        return with_pending(df, pending)
+
+
+def counted(request):
+    # googleapiclient hands response callbacks the HTTP headers, before it
+    # checks the status, so count writes once execute() has returned
+    def execute():
+        response = request.execute()
+        count_request(response)
+        return response
+    return Request(execute)
+
+
+def append_to_sheet(rows, spreadsheet_id, range_):
+    request = get_storage().append(spreadsheet_id, range_, rows)
+    request.add_response_callback(lambda response: invalidate_cache(spreadsheet_id, range_))
+    return counted(request)
+
+
+def sheet_values(df):
+    # Dates go to the sheet as YYYY-MM-DD strings and missing cells as blanks
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime("%Y-%m-%d")
+    df = df.astype(object).where(df.notna(), "")
+    return df.values.tolist()
+
+
 def write_to_sheet(df, spreadsheet_id, range_):
-    value_input_option = "USER_ENTERED"
     data = [df.columns.values.tolist()]
-    data.extend(df.values.tolist())
-    value_range_body = {"values": data}
-    request = service.spreadsheets().values().update(spreadsheetId=spreadsheet_id, range=range_, valueInputOption=value_input_option, body=value_range_body)
-    return request
+    data.extend(sheet_values(df))
+    request = get_storage().update(spreadsheet_id, range_, data)
+    request.add_response_callback(lambda response: invalidate_cache(spreadsheet_id, range_))
+    return counted(request)
 
 
+@timed()
 def prep_by_name(df, name):
     named_df = df[df["Name"] == name]
     named_grp = named_df.groupby(["Week", "Week Date"])[["Minutes", "Distance"]].sum().reset_index()
@@ -70,30 +383,96 @@ def prep_by_name(df, name):
     return named_grp
 
 
+@timed()
 def week_dates(start_date, end_date):
-    weeks = []
-    tally_week = start_date
-    while tally_week <= pd.to_datetime(end_date):
-        weeks.append(tally_week)
-        tally_week = tally_week + timedelta(days=7)
-    weeks = pd.DataFrame(weeks, columns=["Week Date"])
-    weeks["Week"] = weeks["Week Date"].apply(lambda x: x.isocalendar().week)
+    weeks = pd.DataFrame({"Week Date": pd.date_range(start_date, pd.to_datetime(end_date), freq="7D")})
+    weeks["Week"] = weeks["Week Date"].dt.isocalendar().week.astype(int)
     weeks = weeks[["Week", "Week Date"]]
     return weeks
 
 
+@timed()
 def combine_indiviual_dfs(lauren, tara, weeks):
-    combined = weeks.merge(lauren, on=["Week", "Week Date"], how="left")
-    combined = combined.merge(tara, on=["Week", "Week Date"], how="left", suffixes=["_l", "_t"]).rename(columns={"Minutes_l": "Minutes (Lauren)", "Minutes_t": "Minutes (Tara)", "Workouts_l": "Workouts (Lauren)", "Workouts_t": "Workouts (Tara)", "Distance_l": "Distance (Lauren)", "Distance_t": "Distance (Tara)", "Points_l": "Points (Lauren)", "Points_t": "Points (Tara)"})
-    
+    weekly = pd.concat([lauren.assign(Name="Lauren"), tara.assign(Name="Tara")], ignore_index=True)
+    return leaderboard(weekly, weeks, ["Lauren", "Tara"])
+
+
+@timed()
+def weekly_by_person(df):
+    # Every person's weekly totals from one groupby over the whole frame
+    keys = ["Name", "Week", "Week Date"]
+    totals = df[["Minutes", "Distance"]].astype({"Minutes": "int64", "Distance": "float64"})
+    weekly = totals.groupby([df[key] for key in keys], observed=True).sum()
+    workouts = df[df["Minutes"] > 0].groupby(keys, observed=True).size()
+    weekly["Workouts"] = workouts.reindex(weekly.index, fill_value=0).astype(int)
+    weekly["Points"] = (weekly["Minutes"] * weekly["Workouts"]).astype(int)
+    weekly = weekly.reset_index()
+    weekly["Name"] = weekly["Name"].astype(str)
+    weekly["Week"] = weekly["Week"].astype(int)
+    weekly["Week Date"] = pd.to_datetime(weekly["Week Date"])
+    return weekly
+
+
+@timed()
+def weekly_totals(spreadsheet_id, range_name, df=None, new_range="new_data!A:H"):
+    # Backends that can aggregate (SQLite) do the groupby themselves, for
+    # Sheets it happens here on the fetched frame
+    storage = get_storage()
+    if hasattr(storage, "weekly_totals") and len(pending_rows(spreadsheet_id, new_range)) == 0:
+        return storage.weekly_totals(spreadsheet_id, [range_name, new_range])
+    if df is None:
+        df = historic_and_new_data(range_name, spreadsheet_id, new_range)
+    return weekly_by_person(df)
+
+
+@timed()
+def leaderboard(weekly, weeks, names=None, **rules):
+    # One row per week with a "<Metric> (<Name>)" column per person
+    if names is None:
+        names = sorted(weekly["Name"].unique())
+    metrics = ["Minutes", "Distance", "Workouts", "Points"]
+    wide = weekly.pivot(index=["Week", "Week Date"], columns="Name", values=metrics)
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([metrics, names]))
+    wide.columns = [f"{metric} ({name})" for metric, name in wide.columns]
+    wide = wide[[f"{metric} ({name})" for name in names for metric in metrics]].reset_index()
+
+    combined = weeks.merge(wide, on=["Week", "Week Date"], how="left")
     nullable = [col for col in combined.columns.tolist() if "(" in col]
-    for col in nullable:
-        combined[col] = combined[col].fillna(0)
-    combined["Winner"] = combined.apply(lambda row: "None :(" if (row["Minutes (Lauren)"] < 90 and row["Minutes (Tara)"] < 90) or (row["Workouts (Lauren)"] < 3 and row["Workouts (Tara)"] < 3) else ("Lauren" if (row["Minutes (Lauren)"] * row["Workouts (Lauren)"]) > (row["Minutes (Tara)"] * row["Workouts (Tara)"]) else ("Tara" if (row["Minutes (Lauren)"] * row["Workouts (Lauren)"]) < (row["Minutes (Tara)"] * row["Workouts (Tara)"]) else "Tie")), axis=1)
+    combined[nullable] = combined[nullable].fillna(0)
+    combined["Winner"] = pick_winners(combined, names, **rules)
     combined = combined.sort_values(by="Week Date").reset_index(drop=True)
     return combined
 
 
+def standings(combined, names):
+    points = combined[[f"Points ({name})" for name in names]].to_numpy()
+    table = pd.DataFrame({
+        "Name": names,
+        "Wins": combined["Winner"].value_counts().reindex(names, fill_value=0).to_numpy(),
+        "Total Points": points.sum(axis=0).astype(int),
+        "Avg Points": points.mean(axis=0).round(1),
+    })
+    table = table.sort_values(["Wins", "Total Points"], ascending=False).reset_index(drop=True)
+    table.insert(0, "Rank", table.index + 1)
+    return table
+
+
+def pick_winners(combined, names, min_minutes=90, min_workouts=3, tie_label="Tie", none_label="None :("):
+    # Nobody wins a week where everyone is under the minutes threshold or
+    # everyone is under the workouts threshold, otherwise most points wins
+    if len(names) == 0:
+        return np.full(len(combined), none_label, dtype=object)
+    minutes = combined[[f"Minutes ({name})" for name in names]].to_numpy()
+    workouts = combined[[f"Workouts ({name})" for name in names]].to_numpy()
+    points = combined[[f"Points ({name})" for name in names]].to_numpy()
+
+    no_winner = (minutes < min_minutes).all(axis=1) | (workouts < min_workouts).all(axis=1)
+    leaders = points == points.max(axis=1, keepdims=True)
+    tie = leaders.sum(axis=1) > 1
+    leader = np.asarray(names, dtype=object)[leaders.argmax(axis=1)]
+    return np.select([no_winner, tie], [none_label, tie_label], default=leader)
+
+
 def weekly_minutes_workouts_points(named_df, week):
     # Minutes
     try:
@@ -116,6 +495,38 @@ def weekly_minutes_workouts_points(named_df, week):
     return minutes, workouts, points
 
 
+def frame_hash(df):
+    # Content hash of a frame, used to key cached figures and tables
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).values)
+    digest.update(",".join(map(str, df.columns)).encode())
+    return digest.hexdigest()
+
+
+@timed()
+def week_index(weekly):
+    # (Name, Week Date) -> (Minutes, Workouts, Points), built once per weekly
+    # frame (the app caches it on the frame's hash) so every per-person,
+    # per-week lookup is a dict hit rather than a scan
+    keys = zip(weekly["Name"], weekly["Week Date"])
+    values = zip(weekly["Minutes"].astype(int), weekly["Workouts"].astype(int), weekly["Points"].astype(int))
+    return dict(zip(keys, values))
+
+
+def week_metrics(index, name, week):
+    return index.get((name, pd.Timestamp(week)), (0, 0, 0))
+
+
+def window_metrics(index, name, weeks):
+    # Summed metrics over several weeks, e.g. the last 4 or season to date
+    minutes, workouts, points = 0, 0, 0
+    for week in weeks:
+        week_minutes, week_workouts, week_points = week_metrics(index, name, week)
+        minutes += week_minutes
+        workouts += week_workouts
+        points += week_points
+    return minutes, workouts, points
+
+
 def weekly_aggs(named_df):
     avg_min = round(named_df["Minutes"].mean(), 1)
     med_min = named_df["Minutes"].median()
@@ -126,41 +537,300 @@ def weekly_aggs(named_df):
     return avg_min, med_min, avg_wo, med_wo, avg_pts
 
 
+class RunningStats:
+    # Running sum/count for the mean plus a sorted list for the median, so a
+    # value can be added or swapped out without a rescan
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.values = []
+
+    def add(self, value):
+        bisect.insort(self.values, value)
+        self.total += value
+        self.count += 1
+
+    def remove(self, value):
+        del self.values[bisect.bisect_left(self.values, value)]
+        self.total -= value
+        self.count -= 1
+
+    def mean(self):
+        return round(self.total / self.count, 1) if self.count else 0
+
+    def median(self):
+        return sorted_median(self.values)
+
+
+def sorted_median(values):
+    n = len(values)
+    if n == 0:
+        return 0
+    if n % 2:
+        return float(values[n // 2])
+    return (values[n // 2 - 1] + values[n // 2]) / 2
+
+
+class WeeklyAggregator:
+    # Per-person weekly totals kept up to date as workouts are logged, with
+    # all-time stats maintained incrementally and rolling/season windows
+    # read off the week-ordered history
+    metrics = ["Minutes", "Workouts", "Points"]
+
+    def __init__(self, windows=(4, 12, 52)):
+        self.windows = windows
+        self.lock = threading.Lock()
+        self.load(pd.DataFrame(columns=["Name", "Week Date", "Minutes", "Workouts", "Distance"]))
+
+    def load(self, weekly, rows_seen=0):
+        with self.lock:
+            self.weeks = {}
+            self.week_order = {}
+            self.all_time = {}
+            for name, week, minutes, workouts, distance in zip(weekly["Name"], weekly["Week Date"], weekly["Minutes"], weekly["Workouts"], weekly["Distance"]):
+                self._set_week(name, pd.Timestamp(week), int(minutes), int(workouts), float(distance))
+            self.rows_seen = rows_seen
+
+    def log(self, name, week_date, minutes, distance=0):
+        with self.lock:
+            week = pd.Timestamp(week_date)
+            old_minutes, old_workouts, old_distance = self.weeks.get(name, {}).get(week, (0, 0, 0.0))
+            self._set_week(name, week, old_minutes + minutes, old_workouts + int(minutes > 0), old_distance + distance)
+            self.rows_seen += 1
+
+    def _set_week(self, name, week, minutes, workouts, distance):
+        weeks = self.weeks.setdefault(name, {})
+        old = weeks.get(week)
+        if old is None:
+            bisect.insort(self.week_order.setdefault(name, []), week)
+        else:
+            for metric, value in zip(self.metrics, self._metric_values(old)):
+                self.all_time[(name, metric)].remove(value)
+        weeks[week] = (minutes, workouts, distance)
+        for metric, value in zip(self.metrics, self._metric_values(weeks[week])):
+            self.all_time.setdefault((name, metric), RunningStats()).add(value)
+
+    @staticmethod
+    def _metric_values(week):
+        minutes, workouts, distance = week
+        return minutes, workouts, minutes * workouts
+
+    def aggs(self, name):
+        # Same shape as weekly_aggs
+        with self.lock:
+            minutes, workouts, points = (self.all_time.get((name, metric), RunningStats()) for metric in self.metrics)
+            return minutes.mean(), minutes.median(), workouts.mean(), workouts.median(), points.mean()
+
+    def summary(self, name, start=None, end=None):
+        # Mean/median of each metric over the weeks in [start, end]
+        with self.lock:
+            order = self.week_order.get(name, [])
+            lo = 0 if start is None else bisect.bisect_left(order, pd.Timestamp(start))
+            hi = len(order) if end is None else bisect.bisect_right(order, pd.Timestamp(end))
+            weeks = [self._metric_values(self.weeks[name][week]) for week in order[lo:hi]]
+        summary = {}
+        for i, metric in enumerate(self.metrics):
+            values = sorted(week[i] for week in weeks)
+            summary[f"Avg {metric}"] = round(sum(values) / len(values), 1) if values else 0
+            summary[f"Median {metric}"] = sorted_median(values)
+        return summary
+
+    def rolling(self, name, as_of, season_start=None):
+        as_of = pd.Timestamp(as_of)
+        rows = {"All time": self.summary(name)}
+        if season_start is not None:
+            rows["Season to date"] = self.summary(name, season_start, as_of)
+        for window in self.windows:
+            rows[f"Last {window} weeks"] = self.summary(name, as_of - timedelta(weeks=window - 1), as_of)
+        return pd.DataFrame.from_dict(rows, orient="index")
+
+
+# Tracker tab layout: one minutes column per person plus their activity column
+TRACKER_PEOPLE = {"Lauren": "l_activity", "Tara": "t_activity"}
+
+
 # @st.experimental_memo
 # @st.cache(allow_output_mutation=True)
-def get_and_melt_raw_data(spreadsheet_id, range_name):
+@timed()
+def get_and_melt_raw_data(spreadsheet_id, range_name, people=TRACKER_PEOPLE):
     rows = get_data(spreadsheet_id, range_name)
     raw = pd.DataFrame(rows[1:], columns=rows[0])
-    raw["Day"] = pd.to_datetime(raw["Day"])
+    return melt_raw_data(raw, people)
+
+
+def melt_raw_data(raw, people=TRACKER_PEOPLE):
+    try:
+        raw["Day"] = pd.to_datetime(raw["Day"])
+    except ValueError:
+        # Older rows mix 4/4/2021 and 7/4/21, only parse per element then
+        raw["Day"] = pd.to_datetime(raw["Day"], format="mixed")
     raw = raw.sort_values("Day").drop_duplicates()
-    melted_l = raw[["Day", "Lauren", "l_activity"]].rename(columns={"l_activity": "Activity"}).melt(id_vars=["Day", "Activity"], value_vars=["Lauren"], var_name="Name", value_name="Minutes")
-    melted_t = raw[["Day", "Tara", "t_activity"]].rename(columns={"t_activity": "Activity"}).melt(id_vars=["Day", "Activity"], value_vars=["Tara"], var_name="Name", value_name="Minutes")
-    melted = pd.concat([melted_l, melted_t])
-    melted["Day"] = pd.to_datetime(melted["Day"])
-    melted["Week"] = melted["Day"].apply(lambda x: x.isocalendar()[1])
-    melted["Week Date"] = melted["Day"].apply(lambda x: x - timedelta(days=x.weekday() % 7))
-    melted["Day"] = melted["Day"].astype(str)
-    melted["Week Date"] = melted["Week Date"].astype(str)
-    melted = melted[["Day", "Week", "Week Date", "Name", "Activity", "Minutes"]]
+    melted = pd.concat([pd.DataFrame({
+        "Day": raw["Day"].to_numpy(),
+        "Activity": raw[activity].to_numpy() if activity in raw else "",
+        "Name": name,
+        "Minutes": raw[name].to_numpy(),
+    }) for name, activity in people.items() if name in raw])
+    melted["Week"] = melted["Day"].dt.isocalendar().week.astype(int)
+    melted["Week Date"] = melted["Day"].dt.to_period("W-SUN").dt.start_time
+    # The tracker has no distances, but the data tab layout does
+    melted["Distance"] = 0
+    melted = melted[["Day", "Week", "Week Date", "Name", "Activity", "Minutes", "Distance"]]
     return melted
 
 
 def check_input(log_name, log_minutes):
+    import streamlit as st
     if len(log_name) < 1:
         st.sidebar.error("Name field is required")
     elif log_minutes < 1:
         st.sidebar.error("Minutes must be more than 0")
 
 
+def row_key(values):
+    # Sheets hands back strings while the form gives ints, floats and dates,
+    # so normalise each cell before comparing rows
+    key = []
+    for value in values:
+        if hasattr(value, "strftime"):
+            value = value.strftime("%Y-%m-%d")
+        value = "" if pd.isna(value) else str(value).strip()
+        try:
+            number = float(value)
+            if number == number:
+                value = number
+        except ValueError:
+            pass
+        key.append(value)
+    # The API leaves trailing blank cells off, so a row logged with no notes
+    # comes back a cell shorter than it went out
+    while len(key) > 0 and key[-1] == "":
+        key.pop()
+    return tuple(key)
+
+
 def write_new_rows(values, cols, df, spreadsheet_id, range):
-    rows = pd.DataFrame([values], columns=cols)
-    new_data = pd.concat([df, rows])
-    new_data = new_data.drop_duplicates()
-    request = write_to_sheet(new_data, spreadsheet_id, range)
+    return append_new_rows([values], cols, df, spreadsheet_id, range)
+
+
+def same_day_rows(rows, cols, df):
+    # Only rows for the same day and person can match, so narrow df with a
+    # vectorized mask before building keys and keep the cost independent of
+    # how much history there is
+    if "Day" not in cols or "Day" not in df:
+        return df
+    days = pd.to_datetime([values[cols.index("Day")] for values in rows], errors="coerce")
+    mask = pd.to_datetime(df["Day"], errors="coerce").isin(days)
+    if "Name" in cols and "Name" in df:
+        mask &= df["Name"].isin([values[cols.index("Name")] for values in rows])
+    return df[mask]
+
+
+def unseen_rows(rows, cols, df):
+    # Rows that aren't already in the sheet (or earlier in the batch), so
+    # resubmitting the form doesn't log the same workout twice
+    existing = {row_key(row) for row in same_day_rows(rows, cols, df).reindex(columns=cols).itertuples(index=False)}
+    new_rows = []
+    for values in rows:
+        key = row_key(values)
+        if key not in existing:
+            existing.add(key)
+            new_rows.append(list(values))
+    return new_rows
+
+
+def append_new_rows(rows, cols, df, spreadsheet_id, range):
+    new_rows = unseen_rows(rows, cols, df)
+    if len(new_rows) == 0:
+        return None
+    request = append_to_sheet(new_rows, spreadsheet_id, range)
     response = request.execute()
     return response
 
 
+def workout_rows(log_date, log_name, log_activity, log_minutes, log_distance, log_notes, df, participants):
+    week_date = log_date - timedelta(days=log_date.weekday() % 7)
+    week = log_date.isocalendar()[1]
+    rows = []
+    # Everyone gets a placeholder row so the week shows up in the aggregations
+    recorded = set(df.loc[pd.to_datetime(df["Week Date"]) == pd.Timestamp(week_date), "Name"])
+    for name in participants:
+        if name not in recorded:
+            rows.append([log_date.strftime("%Y-%m-%d"), str(week), week_date.strftime("%Y-%m-%d"), name, "", str(0), str(0), "placeholder for aggregation"])
+    for name in log_name:
+        rows.append([log_date.strftime("%Y-%m-%d"), str(week), week_date.strftime("%Y-%m-%d"), name, log_activity.lower(), str(log_minutes), log_distance, log_notes])
+    return rows
+
+
+@timed()
+def submit_workout(log_date, log_name, log_activity, log_minutes, log_distance, log_notes, df, cols, participants, spreadsheet_id, range):
+    # Placeholders and workouts for one form submit go out in a single
+    # append, returns the rows that were actually written
+    rows = workout_rows(log_date, log_name, log_activity, log_minutes, log_distance, log_notes, df, participants)
+    new_rows = unseen_rows(rows, cols, df)
+    if len(new_rows) == 0:
+        return new_rows
+    if _outbox is not None:
+        _outbox.enqueue(spreadsheet_id, range, new_rows)
+    else:
+        append_to_sheet(new_rows, spreadsheet_id, range).execute()
+    return new_rows
+
+
+# Write-behind queue for submits, only used once the app starts it
+OUTBOX_PATH = os.environ.get("WWO_OUTBOX", ".outbox.sqlite")
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def start_outbox(path=OUTBOX_PATH, **options):
+    # One queue and worker per process, rows left over from a previous run
+    # are sent as soon as it starts
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(path, send_rows, **options).start()
+        return _outbox
+
+
+def send_rows(spreadsheet_id, range_, rows, recheck):
+    if recheck:
+        # An earlier try may have reached the sheet before failing (a timeout,
+        # say), don't append those rows a second time
+        sent = {row_key(row) for row in get_data(spreadsheet_id, range_, cache=False)}
+        rows = [row for row in rows if row_key(row) not in sent]
+    if len(rows) > 0:
+        append_to_sheet(rows, spreadsheet_id, range_).execute()
+
+
+def pending_rows(spreadsheet_id, range_):
+    return [] if _outbox is None else _outbox.pending(spreadsheet_id, range_)
+
+
+def with_pending(df, pending):
+    # Rows still in the outbox, shown like they're already in the sheet.
+    # Read before the sheet, so a row confirmed in between is found in both
+    # and skipped here rather than missed. unseen_rows only looks at the
+    # days the queued rows are for, and they're added without re-deduping
+    # or re-sorting the whole history unless they land before its end.
+    if len(pending) == 0:
+        return df
+    if df is not None:
+        pending = unseen_rows(pending, ROW_COLUMNS, df)
+        if len(pending) == 0:
+            return df
+    queued = typed_frame(pending, ROW_COLUMNS)
+    if df is None:
+        return queued
+    merged = pd.concat([df, queued], ignore_index=True)
+    for col in ["Name", "Activity"]:
+        merged[col] = union_categoricals([df[col], queued[col]])
+    if queued["Day"].min() < df["Day"].max():
+        merged = merged.sort_values(by="Day", kind="stable").reset_index(drop=True)
+    return merged
+
+
 def add_whitespace(line_count):
+    import streamlit as st
     for i in range(0, line_count):
         st.write("")
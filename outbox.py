@@ -0,0 +1,184 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+# Write-behind queue for appends. Rows are committed to a local SQLite file
+# straight away and a background thread sends them on: rows queued close
+# together for the same range go out as one append, sends are spaced to
+# stay under the Sheets write quota, and 429s/5xx/network errors are retried
+# with exponential backoff (anything else marks the rows failed). Rows stay
+# in the outbox (and visible through pending()) until the append has gone
+# through.
+#
+# Every worker claims a batch (status 'sending', its owner id and a lease)
+# before sending it, so two workers on the same file (two app processes, or
+# the old and new worker after Streamlit re-imports funcs) never send the
+# same rows. A claim whose worker died goes back to pending once its lease
+# runs out, and is rechecked against the sheet before it's sent again.
+logger = logging.getLogger("wwo.outbox")
+
+
+def retryable(error):
+    # 429s and 5xx from googleapiclient's HttpError (it carries the response),
+    # plus timeouts and dropped connections. Anything else is a bug or a bad
+    # request that won't go through on a retry either.
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status is not None:
+        return int(status) == 429 or int(status) >= 500
+    if isinstance(error, OSError):
+        return True
+    try:
+        import httplib2
+    except ImportError:
+        return False
+    return isinstance(error, httplib2.HttpLib2Error)
+
+
+def retry_after(error):
+    resp = getattr(error, "resp", None)
+    try:
+        return float(resp.get("retry-after", 0)) if resp is not None else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+class Outbox:
+    def __init__(self, path, send, min_interval=1.0, linger=0.25, max_batch=500, base_delay=2.0, max_delay=300.0, lease=300.0):
+        # send(spreadsheet_id, range_name, rows, recheck) appends the rows;
+        # recheck is set when an earlier attempt at them may have landed
+        self.send = send
+        self.min_interval = min_interval
+        self.linger = linger
+        self.max_batch = max_batch
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.owner = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.last_send = 0.0
+        self.thread = None
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY, spreadsheet_id TEXT, range_name TEXT, row TEXT,
+            status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, next_try REAL DEFAULT 0, error TEXT,
+            owner TEXT, lease_until REAL)""")
+        # Outboxes created before claims existed
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+        for column, type_ in [("owner", "TEXT"), ("lease_until", "REAL")]:
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {type_}")
+        self.conn.commit()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="outbox", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def enqueue(self, spreadsheet_id, range_name, rows):
+        with self.lock:
+            self.conn.executemany("INSERT INTO outbox (spreadsheet_id, range_name, row) VALUES (?, ?, ?)",
+                                  [(spreadsheet_id, range_name, json.dumps(row, default=str)) for row in rows])
+            self.conn.commit()
+        self.wake.set()
+
+    def pending(self, spreadsheet_id, range_name):
+        with self.lock:
+            rows = self.conn.execute("SELECT row FROM outbox WHERE spreadsheet_id = ? AND range_name = ? AND status IN ('pending', 'sending') ORDER BY id",
+                                     (spreadsheet_id, range_name)).fetchall()
+        return [json.loads(row) for row, in rows]
+
+    def counts(self):
+        with self.lock:
+            counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return {"pending": counts.get("pending", 0) + counts.get("sending", 0), "failed": counts.get("failed", 0)}
+
+    def run(self):
+        wait = 0
+        while not self.stopping.is_set():
+            if self.wake.wait(wait):
+                self.wake.clear()
+                # Let a burst of submits land so they go out together
+                time.sleep(self.linger)
+            try:
+                wait = self.flush()
+            except Exception:
+                logger.exception("outbox flush failed")
+                wait = self.base_delay
+
+    def flush(self):
+        # Sends every batch that was due when called, returns how long until
+        # the next retry or lease expiry is due (None when nothing is waiting)
+        now = time.time()
+        with self.lock:
+            self.conn.execute("UPDATE outbox SET status = 'pending', owner = NULL WHERE status = 'sending' AND lease_until < ?", (now,))
+            self.conn.commit()
+        while not self.stopping.is_set():
+            entries = self.claim(now)
+            if entries is None:
+                break
+            if len(entries) > 0:
+                self.send_batch(entries[0][1], entries[0][2], entries)
+
+        with self.lock:
+            next_try = self.conn.execute("SELECT MIN(CASE status WHEN 'pending' THEN next_try ELSE lease_until END) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()[0]
+        return None if next_try is None else max(0, next_try - time.time())
+
+    def claim(self, due):
+        # Takes up to max_batch due rows for the range of the oldest one.
+        # None when nothing is due, [] when another worker got there first.
+        with self.lock:
+            oldest = self.conn.execute("SELECT spreadsheet_id, range_name FROM outbox WHERE status = 'pending' AND next_try <= ? ORDER BY id LIMIT 1",
+                                       (due,)).fetchone()
+            if oldest is None:
+                return None
+            lease_until = time.time() + self.lease
+            self.conn.execute("""UPDATE outbox SET status = 'sending', owner = ?, lease_until = ? WHERE id IN (
+                SELECT id FROM outbox WHERE status = 'pending' AND next_try <= ? AND spreadsheet_id = ? AND range_name = ? ORDER BY id LIMIT ?)""",
+                              (self.owner, lease_until, due, *oldest, self.max_batch))
+            self.conn.commit()
+            return self.conn.execute("SELECT id, spreadsheet_id, range_name, row, attempts FROM outbox WHERE status = 'sending' AND owner = ? AND lease_until = ? ORDER BY id",
+                                     (self.owner, lease_until)).fetchall()
+
+    def send_batch(self, spreadsheet_id, range_name, entries):
+        ids = [(entry[0],) for entry in entries]
+        recheck = any(entry[4] > 0 for entry in entries)
+        # Counted before sending, so a crash mid-send means a recheck next time
+        with self.lock:
+            self.conn.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", ids)
+            self.conn.commit()
+        time.sleep(max(0, self.last_send + self.min_interval - time.monotonic()))
+        self.last_send = time.monotonic()
+        try:
+            self.send(spreadsheet_id, range_name, [json.loads(entry[3]) for entry in entries], recheck)
+        except Exception as error:
+            attempts = max(entry[4] for entry in entries) + 1
+            if retryable(error):
+                delay = max(retry_after(error), min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5))
+                logger.warning("append to %s failed (%s), retry %d in %.0fs", range_name, error, attempts, delay)
+                with self.lock:
+                    self.conn.executemany("UPDATE outbox SET status = 'pending', owner = NULL, next_try = ?, error = ? WHERE id = ? AND owner = ?",
+                                          [(time.time() + delay, str(error), id_, self.owner) for id_, in ids])
+                    self.conn.commit()
+            else:
+                logger.error("append to %s failed (%s), giving up on %d rows", range_name, error, len(ids))
+                with self.lock:
+                    self.conn.executemany("UPDATE outbox SET status = 'failed', owner = NULL, error = ? WHERE id = ? AND owner = ?", [(str(error), id_, self.owner) for id_, in ids])
+                    self.conn.commit()
+            return
+        with self.lock:
+            self.conn.executemany("DELETE FROM outbox WHERE id = ?", ids)
+            self.conn.commit()
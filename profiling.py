@@ -0,0 +1,114 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Opt-in timing for a render. Spans nest: each one records its wall time, the
+# rows it produced and the API calls/bytes made while it was open (including
+# by spans inside it). Streamlit runs every session's script on its own
+# thread, so the open spans and the current render are kept per thread.
+#
+# WWO_PROFILE=1 logs every span as a JSON line on the "wwo.profile" logger;
+# start_render(force=True) collects one render's spans without it (the app's
+# ?debug=1 panel). With neither, span() and @timed cost one attribute lookup.
+ENABLED = os.environ.get("WWO_PROFILE", "") not in ("", "0")
+logger = logging.getLogger("wwo.profile")
+if ENABLED and not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+_local = threading.local()
+
+
+class Render:
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.spans = []
+        self.calls = 0
+        self.bytes = 0
+
+    def summary(self):
+        return {"render": self.label, "ms": round((time.perf_counter() - self.started) * 1000, 2), "calls": self.calls, "bytes": self.bytes, "spans": len(self.spans)}
+
+
+def _active():
+    return ENABLED or getattr(_local, "render", None) is not None
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def start_render(label="render", force=False):
+    _local.render = Render(label) if ENABLED or force else None
+    _local.stack = []
+    return _local.render
+
+
+def finish_render():
+    render = getattr(_local, "render", None)
+    _local.render = None
+    if render is not None:
+        logger.info(json.dumps(render.summary()))
+    return render
+
+
+@contextmanager
+def span(name, rows=None):
+    if not _active():
+        yield None
+        return
+    render = getattr(_local, "render", None)
+    stack = _stack()
+    entry = {"span": name, "depth": len(stack), "ms": None, "rows": rows, "calls": 0, "bytes": 0}
+    if render is not None:
+        render.spans.append(entry)
+    stack.append(entry)
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        entry["ms"] = round((time.perf_counter() - start) * 1000, 2)
+        stack.pop()
+        logger.info(json.dumps({"render": None if render is None else render.label, **entry}))
+
+
+def timed(name=None):
+    # Wraps a function in a span named after it; frames and row lists
+    # returned by it count as the span's rows
+    def wrap(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _active():
+                return fn(*args, **kwargs)
+            with span(label) as entry:
+                result = fn(*args, **kwargs)
+                if entry["rows"] is None and (isinstance(result, list) or hasattr(result, "shape")):
+                    entry["rows"] = len(result)
+                return result
+        return wrapper
+    return wrap
+
+
+def count_request(response):
+    # One API round trip, charged to every open span and the render. Also
+    # usable as a request's response callback.
+    if not _active():
+        return
+    size = len(json.dumps(response, default=str))
+    for entry in _stack():
+        entry["calls"] += 1
+        entry["bytes"] += size
+    render = getattr(_local, "render", None)
+    if render is not None:
+        render.calls += 1
+        render.bytes += size
@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import threading
+from datetime import date
+import pandas as pd
+from funcs import SNAPSHOT_DIR, get_sheets, get_storage, historic_and_new_data, leaderboard, standings, synced_data, week_dates, weekly_by_person, write_to_sheet
+from storage import parse_range
+
+# Competitions split into seasons. Each season is a run of whole weeks (by
+# Week Date) and reads either the shared data/new_data tabs, filtered to its
+# weeks, or tabs of its own (see `python seasons.py split`). Once a season
+# has ended its weekly totals and standings are computed once and kept as
+# Parquet, so a render only reads the active season's rows.
+#
+# seasons.json (or the file in WWO_SEASONS) is a list like
+#   [{"name": "2023", "start": "2023-01-02", "end": "2023-12-31"},
+#    {"name": "2024", "start": "2024-01-01", "data": "data_2024!A:H", "new_data": "new_data_2024!A:H"}]
+# Without one there's a single open-ended season over the shared tabs.
+SEASONS_PATH = os.environ.get("WWO_SEASONS", "seasons.json")
+DEFAULT_SEASON = {"name": "all", "start": None, "end": None, "data": "data!A:G", "new_data": "new_data!A:H"}
+_freeze_lock = threading.Lock()
+# Frozen summaries already read in this process, keyed by file and checked
+# against the files' mtimes, so a render doesn't re-read the Parquet
+_frozen = {}
+_past = {}
+
+
+def load_seasons(path=SEASONS_PATH):
+    if not os.path.exists(path):
+        return [dict(DEFAULT_SEASON)]
+    with open(path) as f:
+        seasons = [{**DEFAULT_SEASON, **season} for season in json.load(f)]
+    return sorted(seasons, key=lambda season: season["start"] or "")
+
+
+def active_season(seasons, today):
+    # The season today falls in. Past the last season's end, or between two
+    # seasons, it's an unlisted one on the shared tabs from the Monday after
+    # the last end (up to the next start), so new workouts still show up.
+    today = pd.Timestamp(today)
+    started = [season for season in seasons if season["start"] is None or pd.Timestamp(season["start"]) <= today]
+    for season in reversed(started):
+        if season["end"] is None or today <= pd.Timestamp(season["end"]):
+            return season
+    if len(started) == 0:
+        return seasons[0]
+    last_end = max(pd.Timestamp(season["end"]) for season in started)
+    start = last_end + pd.Timedelta(days=7 - last_end.weekday())
+    upcoming = [pd.Timestamp(season["start"]) for season in seasons if season["start"] is not None and pd.Timestamp(season["start"]) > today]
+    end = min(upcoming) - pd.Timedelta(days=1) if upcoming else None
+    return {**DEFAULT_SEASON, "name": f"after {started[-1]['name']}", "start": start.strftime("%Y-%m-%d"),
+            "end": None if end is None else end.strftime("%Y-%m-%d")}
+
+
+def is_final(season, today):
+    return season["end"] is not None and pd.Timestamp(season["end"]) < pd.Timestamp(today)
+
+
+def own_tabs(season):
+    return season["data"] != DEFAULT_SEASON["data"] or season["new_data"] != DEFAULT_SEASON["new_data"]
+
+
+def first_week(season, df):
+    # Monday of the season's first week, or of the first logged week
+    if season["start"] is None:
+        return df["Week Date"].min()
+    start = pd.Timestamp(season["start"])
+    return start - pd.Timedelta(days=start.weekday())
+
+
+def in_season(df, season):
+    keep = pd.Series(True, index=df.index)
+    if season["start"] is not None:
+        keep &= df["Week Date"] >= first_week(season, df)
+    if season["end"] is not None:
+        keep &= df["Week Date"] <= pd.Timestamp(season["end"])
+    return df if keep.all() else df[keep].reset_index(drop=True)
+
+
+def season_data(spreadsheet_id, season, snapshot_dir=SNAPSHOT_DIR, rebuild=False):
+    partition = parse_range(season["data"])[0] if own_tabs(season) else None
+    df = synced_data(season["data"], spreadsheet_id, snapshot_dir, rebuild, new_range=season["new_data"], partition=partition)
+    return in_season(df, season)
+
+
+def frozen_season(spreadsheet_id, season, snapshot_dir=SNAPSHOT_DIR, rebuild=False):
+    # Weekly totals and standings of a finished season, computed from the
+    # sheet the first time and read back from disk after that
+    prefix = os.path.join(snapshot_dir, f"{spreadsheet_id}-season-{season['name']}")
+    paths = {"weekly": f"{prefix}-weekly.parquet", "standings": f"{prefix}-standings.parquet"}
+    with _freeze_lock:
+        if not rebuild and all(os.path.exists(path) for path in paths.values()):
+            mtimes = tuple(os.path.getmtime(path) for path in paths.values())
+            if prefix not in _frozen or _frozen[prefix][0] != mtimes:
+                _frozen[prefix] = (mtimes, {key: pd.read_parquet(path) for key, path in paths.items()})
+            return _frozen[prefix][1]
+
+        df = in_season(historic_and_new_data(season["data"], spreadsheet_id, season["new_data"]), season)
+        weekly = weekly_by_person(df)
+        names = sorted(weekly["Name"].unique())
+        weeks = week_dates(first_week(season, weekly), season["end"] or weekly["Week Date"].max())
+        frozen = {"weekly": weekly, "standings": standings(leaderboard(weekly, weeks, names), names)}
+
+        os.makedirs(snapshot_dir, exist_ok=True)
+        for key, path in paths.items():
+            frozen[key].to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+        _frozen[prefix] = (tuple(os.path.getmtime(path) for path in paths.values()), frozen)
+        return frozen
+
+
+def past_seasons(spreadsheet_id, seasons, today, snapshot_dir=SNAPSHOT_DIR):
+    # Frozen weekly totals and standings of every finished season, with a
+    # Season column, newest season first
+    frozen = {season["name"]: frozen_season(spreadsheet_id, season, snapshot_dir) for season in seasons if is_final(season, today)}
+    # Keyed on the frozen frames themselves (kept alive in the entry), which
+    # only change when a season's files do
+    key = tuple((name, id(frozen[name])) for name in frozen)
+    if key in _past:
+        return _past[key][1]
+    if len(frozen) == 0:
+        return {"weekly": pd.DataFrame(columns=["Name", "Week", "Week Date", "Minutes", "Distance", "Workouts", "Points"]),
+                "standings": pd.DataFrame(columns=["Season", "Rank", "Name", "Wins", "Total Points", "Avg Points"])}
+    past = {part: pd.concat([frozen[name][part].assign(Season=name) for name in reversed(list(frozen))], ignore_index=True)
+            for part in ["weekly", "standings"]}
+    _past.clear()
+    _past[key] = (frozen, past)
+    return past
+
+
+def split_season(spreadsheet_id, season):
+    # Copy a season's rows out of the shared tabs into the season's own tabs.
+    # Add the tabs to seasons.json for the season afterwards.
+    df = in_season(historic_and_new_data(DEFAULT_SEASON["data"], spreadsheet_id, DEFAULT_SEASON["new_data"]), season)
+    titles = get_sheets(spreadsheet_id)[1]
+    storage = get_storage()
+    for range_name in [season["data"], season["new_data"]]:
+        tab, first_col, last_col = parse_range(range_name)[:3]
+        if tab not in titles and hasattr(storage, "add_tab"):
+            storage.add_tab(spreadsheet_id, tab).execute()
+        columns = ["Day", "Week", "Week Date", "Name", "Activity", "Minutes", "Distance", "Notes"][first_col:last_col]
+        rows = df.reindex(columns=columns) if range_name == season["data"] else df.iloc[:0].reindex(columns=columns)
+        write_to_sheet(rows, spreadsheet_id, range_name).execute()
+    return len(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage competition seasons")
+    parser.add_argument("--spreadsheet-id", default="1BAWUiSI8jV0hSmaD9b_68CaRgSca9J_Odb1TpWRYuZU")
+    parser.add_argument("--seasons", default=SEASONS_PATH, help="season config file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    freeze = commands.add_parser("freeze", help="precompute the summaries of every finished season")
+    freeze.add_argument("--rebuild", action="store_true", help="recompute seasons that are already frozen")
+    split = commands.add_parser("split", help="copy a season's rows from data/new_data into its own tabs")
+    split.add_argument("name")
+    split.add_argument("--data", help="range for the season's rows, e.g. data_2024!A:H")
+    split.add_argument("--new-data", help="range for rows logged during the season, e.g. new_data_2024!A:H")
+    args = parser.parse_args()
+
+    seasons = load_seasons(args.seasons)
+    if args.command == "freeze":
+        for season in seasons:
+            if is_final(season, date.today()):
+                frozen = frozen_season(args.spreadsheet_id, season, rebuild=args.rebuild)
+                print(f"{season['name']}: {len(frozen['weekly'])} person-weeks")
+    else:
+        season = next(season for season in seasons if season["name"] == args.name)
+        season = {**season, "data": args.data or f"data_{args.name}!A:H", "new_data": args.new_data or f"new_data_{args.name}!A:H"}
+        copied = split_season(args.spreadsheet_id, season)
+        print(f"copied {copied} rows to {season['data']}, set \"data\": \"{season['data']}\" and \"new_data\": \"{season['new_data']}\" for {args.name} in {args.seasons}")
@@ -0,0 +1,207 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import pandas as pd
+
+# Storage backends behind funcs' sheet reads and writes. Every call returns a
+# request-like object (execute / add_response_callback) so funcs can treat the
+# Google client and the local stand-in the same way.
+
+
+class SheetsStorage:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheet_id, range_name):
+        return self.service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=range_name)
+
+    def batch_get(self, spreadsheet_id, range_names):
+        return self.service.spreadsheets().values().batchGet(spreadsheetId=spreadsheet_id, ranges=range_names)
+
+    def update(self, spreadsheet_id, range_name, values):
+        return self.service.spreadsheets().values().update(spreadsheetId=spreadsheet_id, range=range_name, valueInputOption="USER_ENTERED", body={"values": values})
+
+    def append(self, spreadsheet_id, range_name, values):
+        return self.service.spreadsheets().values().append(spreadsheetId=spreadsheet_id, range=range_name, valueInputOption="USER_ENTERED", insertDataOption="INSERT_ROWS", body={"values": values})
+
+    def metadata(self, spreadsheet_id):
+        return self.service.spreadsheets().get(spreadsheetId=spreadsheet_id)
+
+    def add_tab(self, spreadsheet_id, title):
+        return self.service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": [{"addSheet": {"properties": {"title": title}}}]})
+
+
+class Request:
+    def __init__(self, fn):
+        self.fn = fn
+        self.callbacks = []
+
+    def add_response_callback(self, cb):
+        self.callbacks.append(cb)
+
+    def execute(self, num_retries=0):
+        response = self.fn()
+        for cb in self.callbacks:
+            cb(response)
+        return response
+
+
+def parse_range(range_name):
+    # "new_data!A2:H" -> ("new_data", 0, 8, 2, None), columns zero-based half-open
+    tab, _, cells = range_name.partition("!")
+    match = re.fullmatch(r"([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?", cells)
+    if match is None:
+        raise ValueError(f"Unsupported range {range_name}")
+    first_col, first_row, last_col, last_row = match.groups()
+    last_col = last_col or first_col
+    return (tab, column_number(first_col) - 1, column_number(last_col),
+            int(first_row) if first_row else 1, int(last_row) if last_row else None)
+
+
+def column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord("A") + 1
+    return number
+
+
+def cell(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        # USER_ENTERED turns 1.0 into 1 in the sheet
+        return str(int(value))
+    return str(value)
+
+
+class SqliteStorage:
+    # Embedded stand-in for the Google Sheets API: one database per spreadsheet,
+    # one table per tab with the tab's header row as its columns. Rows keep
+    # their sheet row number so A1 ranges map onto row_num filters.
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.connections = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def connect(self, spreadsheet_id):
+        if spreadsheet_id not in self.connections:
+            conn = sqlite3.connect(os.path.join(self.directory, f"{spreadsheet_id}.sqlite"), check_same_thread=False)
+            conn.execute("CREATE TABLE IF NOT EXISTS tabs (tab TEXT PRIMARY KEY, sheet_id INTEGER, columns TEXT)")
+            self.connections[spreadsheet_id] = conn
+        return self.connections[spreadsheet_id]
+
+    def header(self, conn, tab):
+        row = conn.execute("SELECT columns FROM tabs WHERE tab = ?", (tab,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def create_tab(self, conn, tab, columns):
+        conn.execute(f'DROP TABLE IF EXISTS "{tab}"')
+        column_defs = ", ".join(f'"{col}" TEXT' for col in columns)
+        conn.execute(f'CREATE TABLE "{tab}" (row_num INTEGER PRIMARY KEY, {column_defs})')
+        if "Name" in columns and "Week Date" in columns:
+            conn.execute(f'CREATE INDEX "{tab}_name_week" ON "{tab}" ("Name", "Week Date")')
+        sheet_id = conn.execute("SELECT COALESCE(MAX(sheet_id) + 1, 0) FROM tabs").fetchone()[0]
+        conn.execute("INSERT OR REPLACE INTO tabs VALUES (?, ?, ?)", (tab, sheet_id, json.dumps(columns)))
+
+    def insert(self, conn, tab, columns, start_row, values):
+        names = ", ".join(f'"{col}"' for col in columns)
+        marks = ", ".join("?" for _ in range(len(columns) + 1))
+        rows = [[start_row + i] + [cell(v) for v in row[:len(columns)]] + [""] * (len(columns) - len(row)) for i, row in enumerate(values)]
+        conn.executemany(f'INSERT OR REPLACE INTO "{tab}" (row_num, {names}) VALUES ({marks})', rows)
+
+    def read(self, spreadsheet_id, range_name):
+        tab, first_col, last_col, first_row, last_row = parse_range(range_name)
+        with self.lock:
+            conn = self.connect(spreadsheet_id)
+            columns = self.header(conn, tab)
+            if columns is None:
+                return {"range": range_name}
+            selected = columns[first_col:last_col]
+            rows = [selected] if first_row == 1 else []
+            if len(selected) > 0:
+                names = ", ".join(f'"{col}"' for col in selected)
+                query = f'SELECT {names} FROM "{tab}" WHERE row_num >= ? AND row_num <= ? ORDER BY row_num'
+                rows += [list(row) for row in conn.execute(query, (max(first_row, 2), last_row or 2 ** 62))]
+        return {"range": range_name, "values": rows} if rows else {"range": range_name}
+
+    def write(self, spreadsheet_id, range_name, values, append):
+        tab, first_col, last_col, first_row, last_row = parse_range(range_name)
+        with self.lock:
+            conn = self.connect(spreadsheet_id)
+            columns = self.header(conn, tab)
+            if not append and first_row == 1:
+                columns = None
+            if columns is None:
+                columns, values = [cell(v) for v in values[0]], values[1:]
+                self.create_tab(conn, tab, columns)
+                first_row = 2
+            if append:
+                first_row = conn.execute(f'SELECT COALESCE(MAX(row_num), 1) + 1 FROM "{tab}"').fetchone()[0]
+            self.insert(conn, tab, columns, first_row, values)
+            conn.commit()
+        return {"updatedRange": range_name, "updatedRows": len(values)}
+
+    def get(self, spreadsheet_id, range_name):
+        return Request(lambda: self.read(spreadsheet_id, range_name))
+
+    def batch_get(self, spreadsheet_id, range_names):
+        return Request(lambda: {"spreadsheetId": spreadsheet_id, "valueRanges": [self.read(spreadsheet_id, range_name) for range_name in range_names]})
+
+    def update(self, spreadsheet_id, range_name, values):
+        return Request(lambda: self.write(spreadsheet_id, range_name, values, append=False))
+
+    def append(self, spreadsheet_id, range_name, values):
+        return Request(lambda: {"updates": self.write(spreadsheet_id, range_name, values, append=True)})
+
+    def metadata(self, spreadsheet_id):
+        def fn():
+            with self.lock:
+                tabs = self.connect(spreadsheet_id).execute("SELECT tab, sheet_id FROM tabs ORDER BY sheet_id").fetchall()
+            return {"spreadsheetId": spreadsheet_id, "sheets": [{"properties": {"title": tab, "sheetId": sheet_id}} for tab, sheet_id in tabs]}
+        return Request(fn)
+
+    def weekly_totals(self, spreadsheet_id, range_names):
+        # Same numbers as weekly_by_person over historic_and_new_data, with the
+        # union/dedup and the groupby done in SQL. Cells are normalised the
+        # way typed_frame does it before the UNION, so 'Walk'/'walk ' or
+        # '30'/'30.0' are one row here too.
+        fields = {
+            "Day": "date({})",
+            "Week": "COALESCE(CAST(CAST({} AS REAL) AS INTEGER), 0)",
+            "Week Date": "date({})",
+            "Name": "{}",
+            "Activity": "lower(trim(COALESCE({}, '')))",
+            "Minutes": "COALESCE(CAST(CAST({} AS REAL) AS INTEGER), 0)",
+            "Distance": "COALESCE(CAST({} AS REAL), 0)",
+            "Notes": "COALESCE({}, '')",
+        }
+        selects = []
+        with self.lock:
+            conn = self.connect(spreadsheet_id)
+            for range_name in range_names:
+                tab = parse_range(range_name)[0]
+                columns = self.header(conn, tab)
+                if columns is not None:
+                    sources = {col: f'"{col}"' if col in columns else "NULL" for col in fields}
+                    select = ", ".join(f'{expr.format(sources[col])} AS "{col}"' for col, expr in fields.items())
+                    # Cleared rows have neither a Day nor a Name
+                    selects.append(f"""SELECT {select} FROM "{tab}" WHERE COALESCE({sources["Day"]}, '') <> '' OR COALESCE({sources["Name"]}, '') <> ''""")
+            if len(selects) == 0:
+                return pd.DataFrame(columns=["Name", "Week", "Week Date", "Minutes", "Distance", "Workouts", "Points"])
+            query = f"""
+                SELECT Name, Week, "Week Date",
+                       SUM(Minutes) AS Minutes,
+                       SUM(Distance) AS Distance,
+                       SUM(Minutes > 0) AS Workouts
+                FROM ({" UNION ".join(selects)})
+                WHERE Name IS NOT NULL AND "Week Date" IS NOT NULL
+                GROUP BY Name, Week, "Week Date"
+                ORDER BY Name, Week, "Week Date"
+            """
+            weekly = pd.read_sql_query(query, conn)
+        weekly["Points"] = weekly["Minutes"] * weekly["Workouts"]
+        weekly["Week Date"] = pd.to_datetime(weekly["Week Date"])
+        return weekly
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funcs
+from bulk_import import bulk_import, load_state, save_state, sheet_writer
+from fakes import TrimmingSheets
+from storage import SheetsStorage
+
+
+def wide(days):
+    return pd.DataFrame({"Day": [f"2024-01-{day:02d}" for day in days], "Lauren": "30", "l_activity": "walk", "Tara": "45", "t_activity": "yoga"})
+
+
+def test_resume_with_other_sizes_is_refused(tmp_path):
+    path = str(tmp_path / "state.json")
+    save_state(path, {**load_state(path, "tracker.csv", 5000, 1000), "rows_done": 5000})
+    assert load_state(path, "tracker.csv", 5000, 1000)["rows_done"] == 5000
+    with pytest.raises(ValueError):
+        load_state(path, "tracker.csv", 5000, 500)
+
+
+def test_batch_sent_before_a_crash_is_not_appended_again(tmp_path):
+    service = TrimmingSheets({"data": []})
+    funcs.set_storage(SheetsStorage(service))
+    path = str(tmp_path / "state.json")
+    write = sheet_writer("x", "data!A:G")
+    written = []
+
+    def crash_after_second(batch, part, recheck=False):
+        write(batch, part, recheck)
+        written.append(part)
+        if len(written) == 2:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        bulk_import([wide(range(1, 5))], crash_after_second, load_state(path, "tracker.csv", 4, 2), path, 2)
+    state = load_state(path, "tracker.csv", 4, 2)
+    assert state["batches_done"] == 1
+    bulk_import([wide(range(1, 5))], sheet_writer("x", "data!A:G"), state, path, 2)
+
+    rows = service.tabs["data"][1:]
+    assert len(rows) == 8
+    assert len({tuple(row) for row in rows}) == 8
@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funcs
+from fakes import TrimmingSheets
+from storage import Request, SheetsStorage
+
+
+class WriteDuringRead(TrimmingSheets):
+    # An append lands (and invalidates the cache) while a read is in flight
+    def get(self, spreadsheetId, range):
+        request = super().get(spreadsheetId, range)
+
+        def read():
+            rows = request.execute()
+            self.tabs["new_data"].append(["2024-01-02", "1", "2024-01-01", "Tara", "yoga", "45"])
+            funcs.invalidate_cache(spreadsheetId, range)
+            return rows
+        return Request(read)
+
+
+def test_read_cached_only_until_a_write():
+    service = TrimmingSheets({"new_data": [funcs.ROW_COLUMNS]})
+    funcs.set_storage(SheetsStorage(service))
+    funcs.invalidate_cache("x")
+    assert funcs.get_data("x", "new_data!A:H") == [funcs.ROW_COLUMNS]
+    service.tabs["new_data"].append(["2024-01-02", "1", "2024-01-01", "Tara", "yoga", "45"])
+    assert len(funcs.get_data("x", "new_data!A:H")) == 1
+    funcs.invalidate_cache("x", "new_data!A2:H")
+    assert len(funcs.get_data("x", "new_data!A:H")) == 2
+
+
+def test_read_that_raced_a_write_is_not_cached():
+    service = WriteDuringRead({"new_data": [funcs.ROW_COLUMNS]})
+    funcs.set_storage(SheetsStorage(service))
+    funcs.invalidate_cache("x")
+    assert len(funcs.get_data("x", "new_data!A:H")) == 1
+    funcs.set_storage(SheetsStorage(TrimmingSheets(service.tabs)))
+    assert len(funcs.get_data("x", "new_data!A:H")) == 2
@@ -0,0 +1,96 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funcs
+from fakes import TrimmingSheets
+from outbox import Outbox
+from storage import SheetsStorage
+
+
+def test_retry_after_timeout_does_not_append_twice(tmp_path):
+    service = TrimmingSheets({"new_data": [funcs.ROW_COLUMNS]})
+    service.timeouts = 1
+    funcs.set_storage(SheetsStorage(service))
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"), funcs.send_rows, min_interval=0, linger=0, base_delay=0.01, max_delay=0.01)
+    row = ["2024-01-01", "1", "2024-01-01", "Lauren", "walk", "30", "1.5", ""]
+    outbox.enqueue("x", "new_data!A:H", [row])
+
+    outbox.flush()
+    assert outbox.counts() == {"pending": 1, "failed": 0}
+    time.sleep(0.05)
+    outbox.flush()
+
+    assert service.tabs["new_data"] == [funcs.ROW_COLUMNS, row]
+    assert outbox.counts() == {"pending": 0, "failed": 0}
+
+
+def test_row_key_ignores_trailing_blanks():
+    assert funcs.row_key(["2024-01-01", "1", "walk", ""]) == funcs.row_key(["2024-01-01", 1, "walk"])
+
+
+class Response(dict):
+    def __init__(self, status):
+        super().__init__()
+        self.status = status
+
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = Response(status)
+
+
+def test_only_quota_server_and_network_errors_are_retried(tmp_path):
+    errors = [HttpError(429), HttpError(503), socket.timeout("timed out"), ConnectionResetError(), HttpError(400), KeyError("Distance"), ValueError("Unsupported range")]
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"), lambda *args: None, min_interval=0, linger=0)
+    for i, error in enumerate(errors):
+        def send(spreadsheet_id, range_name, rows, recheck, error=error):
+            raise error
+        outbox.send = send
+        outbox.enqueue("x", "new_data!A:H", [[i]])
+        outbox.flush()
+
+    statuses = [status for status, in outbox.conn.execute("SELECT status FROM outbox ORDER BY id")]
+    assert statuses == ["pending"] * 4 + ["failed"] * 3
+
+
+def test_two_workers_on_one_file_send_each_row_once(tmp_path):
+    sent = []
+
+    def send(spreadsheet_id, range_name, rows, recheck):
+        time.sleep(0.05)
+        sent.extend(rows)
+
+    path = str(tmp_path / "outbox.sqlite")
+    first = Outbox(path, send, min_interval=0, linger=0, max_batch=2)
+    second = Outbox(path, send, min_interval=0, linger=0, max_batch=2)
+    first.enqueue("x", "new_data!A:H", [[i] for i in range(6)])
+    workers = [threading.Thread(target=outbox.flush) for outbox in [first, second]]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(sent) == [[i] for i in range(6)]
+    assert first.counts() == {"pending": 0, "failed": 0}
+
+
+def test_expired_claim_is_rechecked_and_sent(tmp_path):
+    calls = []
+    path = str(tmp_path / "outbox.sqlite")
+    dead = Outbox(path, lambda *args: None, lease=0)
+    dead.enqueue("x", "new_data!A:H", [["a"]])
+    # Claimed and counted, then the worker went away mid-send
+    dead.conn.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", [(entry[0],) for entry in dead.claim(time.time())])
+    dead.conn.commit()
+    assert dead.pending("x", "new_data!A:H") == [["a"]]
+
+    outbox = Outbox(path, lambda *args: calls.append(args), min_interval=0, linger=0)
+    time.sleep(0.01)
+    outbox.flush()
+    assert calls == [("x", "new_data!A:H", [["a"]], True)]
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seasons import DEFAULT_SEASON, active_season, in_season, is_final
+
+SEASONS = [{**DEFAULT_SEASON, "name": "2023", "start": "2023-01-02", "end": "2023-12-31"},
+           {**DEFAULT_SEASON, "name": "2024", "start": "2024-01-08", "end": "2024-12-29"}]
+
+
+def test_active_season_is_the_one_today_falls_in():
+    assert active_season(SEASONS, "2024-06-01")["name"] == "2024"
+
+
+def test_after_the_last_season_ends_new_workouts_still_show():
+    season = active_season(SEASONS, "2025-01-08")
+    assert not is_final(season, "2025-01-08")
+    assert season["start"] == "2024-12-30" and season["end"] is None
+    df = pd.DataFrame({"Week Date": pd.to_datetime(["2024-12-23", "2025-01-06"])})
+    assert in_season(df, season)["Week Date"].tolist() == [pd.Timestamp("2025-01-06")]
+
+
+def test_gap_between_seasons_runs_up_to_the_next_start():
+    season = active_season(SEASONS, "2024-01-03")
+    assert not is_final(season, "2024-01-03")
+    assert (season["start"], season["end"]) == ("2024-01-01", "2024-01-07")
@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funcs
+from fakes import TrimmingSheets
+from storage import SheetsStorage
+
+
+def workout(day, name, minutes):
+    return [day, "1", "2024-01-01", name, "walk", str(minutes), "0", ""]
+
+
+def sync(service, tmp_path, **options):
+    funcs.set_storage(SheetsStorage(service))
+    funcs.invalidate_cache("x")
+    df = funcs.synced_data("data!A:H", "x", str(tmp_path), **options)
+    return [(day.strftime("%Y-%m-%d"), name, minutes) for day, name, minutes in zip(df["Day"], df["Name"], df["Minutes"])]
+
+
+def test_appended_rows_are_picked_up(tmp_path):
+    service = TrimmingSheets({"data": [funcs.ROW_COLUMNS, workout("2024-01-01", "Lauren", 30)], "new_data": [funcs.ROW_COLUMNS]})
+    sync(service, tmp_path)
+    service.tabs["new_data"].append(workout("2024-01-02", "Tara", 45))
+    assert sync(service, tmp_path) == [("2024-01-01", "Lauren", 30), ("2024-01-02", "Tara", 45)]
+
+
+def test_deleted_row_triggers_a_full_read(tmp_path):
+    rows = [workout(f"2024-01-0{day}", "Lauren", 10 * day) for day in range(1, 5)]
+    service = TrimmingSheets({"data": [funcs.ROW_COLUMNS] + rows, "new_data": [funcs.ROW_COLUMNS]})
+    sync(service, tmp_path)
+    del service.tabs["data"][2]
+    service.tabs["data"].append(workout("2024-01-05", "Lauren", 50))
+    assert [minutes for _, _, minutes in sync(service, tmp_path)] == [10, 30, 40, 50]
+
+
+def test_edited_last_row_triggers_a_full_read(tmp_path):
+    service = TrimmingSheets({"data": [funcs.ROW_COLUMNS, workout("2024-01-01", "Lauren", 30)], "new_data": [funcs.ROW_COLUMNS]})
+    sync(service, tmp_path)
+    service.tabs["data"][1] = workout("2024-01-01", "Lauren", 60)
+    assert sync(service, tmp_path) == [("2024-01-01", "Lauren", 60)]
+
+
+def test_rebuild_rereads_older_edits(tmp_path):
+    service = TrimmingSheets({"data": [funcs.ROW_COLUMNS, workout("2024-01-01", "Lauren", 30), workout("2024-01-02", "Tara", 45)], "new_data": [funcs.ROW_COLUMNS]})
+    sync(service, tmp_path)
+    service.tabs["data"][1] = workout("2024-01-01", "Lauren", 60)
+    assert sync(service, tmp_path)[0] == ("2024-01-01", "Lauren", 30)
+    assert sync(service, tmp_path, rebuild=True)[0] == ("2024-01-01", "Lauren", 60)
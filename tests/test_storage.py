@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funcs
+from storage import SqliteStorage
+
+
+def test_sql_weekly_totals_match_pandas(tmp_path):
+    storage = SqliteStorage(str(tmp_path))
+    storage.update("x", "data!A1:G", [funcs.ROW_COLUMNS[:7],
+                                      ["2024-01-01", "1", "2024-01-01", "Lauren", "Walk", "30", "1.5"],
+                                      ["2024-01-02", "1", "2024-01-01", "Tara", "yoga", "45", ""],
+                                      [],
+                                      ["2024-01-09", "2", "2024-01-08", "Tara", "bike", "abc", "2"]]).execute()
+    storage.update("x", "new_data!A1:H", [funcs.ROW_COLUMNS,
+                                          # The same workouts, logged again with different spellings
+                                          ["2024-01-01", "1", "2024-01-01", "Lauren", " walk ", "30.0", "1.50", ""],
+                                          ["2024-01-02", "1.0", "2024-01-01", "Tara", "Yoga", "45", "0", ""],
+                                          ["2024-01-03", "1", "2024-01-01", "Lauren", "bike", "60", "10", "hills"]]).execute()
+    funcs.set_storage(storage)
+    funcs.invalidate_cache("x")
+
+    sql = storage.weekly_totals("x", ["data!A:G", "new_data!A:H"])
+    expected = funcs.weekly_by_person(funcs.historic_and_new_data("data!A:G", "x", "new_data!A:H"))
+    columns = ["Name", "Week", "Week Date", "Minutes", "Distance", "Workouts", "Points"]
+    sql, expected = (frame[columns].sort_values(["Name", "Week Date"]).reset_index(drop=True) for frame in (sql, expected))
+    pd.testing.assert_frame_equal(sql, expected, check_dtype=False)
+    assert sql.loc[sql["Name"] == "Lauren", "Workouts"].tolist() == [2]
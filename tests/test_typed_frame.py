@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funcs
+
+
+def test_rows_are_typed_and_normalised():
+    df = funcs.typed_frame([["2024-01-02", "1", "2024-01-01", "Lauren", " Walk ", "30", "1.5", "nice"]], funcs.ROW_COLUMNS)
+    assert list(df.columns) == funcs.ROW_COLUMNS
+    assert str(df["Day"].dtype) == "datetime64[ns]" and str(df["Minutes"].dtype) == "int16" and str(df["Distance"].dtype) == "float32"
+    assert df["Activity"].tolist() == ["walk"]
+
+
+def test_short_rows_and_missing_columns_are_filled():
+    # Old data tabs stop before Distance, and the API drops trailing blanks
+    df = funcs.typed_frame([["2024-01-02", "1", "2024-01-01", "Tara", "yoga"]], funcs.ROW_COLUMNS[:6])
+    assert df[["Minutes", "Distance"]].values.tolist() == [[0, 0.0]]
+
+
+def test_cleared_rows_are_dropped():
+    rows = [["2024-01-02", "1", "2024-01-01", "Lauren", "walk", "30"], [], ["", "", "", "", ""], ["2024-01-03", "1", "2024-01-01", "Tara", "yoga", "45"]]
+    df = funcs.typed_frame(rows, funcs.ROW_COLUMNS)
+    assert sorted(df["Name"].unique()) == ["Lauren", "Tara"]
+    assert len(df) == 2